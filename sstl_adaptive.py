@@ -0,0 +1,316 @@
+import sys
+from sstl_math import *
+
+def square_roots(rows, cols):
+    """
+    Returns the root triangles (see adaptive_triangulation) covering a
+    grid of points with the given numbers of rows and columns: the grid is
+    tiled with squares as wide as its shorter side, each split into two
+    along the same diagonal as grid_lattice uses.
+    
+    Arguments:
+    rows, cols -- int numbers of rows and columns of points, each one more
+                  than a power of 2
+    
+    Return -- (R, 3, 2) int array of the (row, column) coordinates of the
+              corners of each root triangle
+    """
+    
+    if not (is_power_of_two(rows - 1) and is_power_of_two(cols - 1)):
+        sys.exit("Error: adaptive subdivision needs resolutions that are"
+                 + " powers of 2")
+    
+    size = min(rows - 1, cols - 1)
+    r, c = np.meshgrid(np.arange(0, rows - 1, size),
+                       np.arange(0, cols - 1, size), indexing="ij")
+    corners = np.stack((r.ravel(), c.ravel()), axis=-1)[:, np.newaxis]
+    down = np.array((size, 0))
+    right = np.array((0, size))
+    
+    # both triangles of each square are counterclockwise as (row, column),
+    # like the triangles of grid_lattice
+    first = np.stack((down, right, (0, 0)))
+    second = np.stack((right, down, down + right))
+    
+    return np.concatenate((corners + first, corners + second))
+
+def triangle_roots(res):
+    """
+    Returns the root triangle (see adaptive_triangulation) of the grid of
+    points of a TriFace with res + 1 rows (see tri_face_lattice), where
+    point j of row i is at (row, column) (i, j): a right triangle with its
+    right angle at the start of the last row.
+    
+    Arguments:
+    res -- int resolution of the TriFace, a power of 2
+    
+    Return -- (1, 3, 2) int array, as for square_roots
+    """
+    
+    if not is_power_of_two(res):
+        sys.exit("Error: adaptive subdivision needs resolutions that are"
+                 + " powers of 2")
+    
+    return np.array([((res, res), (0, 0), (res, 0))])
+
+def root_owners(roots, rows, cols):
+    """
+    Returns the index of the root triangle (see adaptive_triangulation)
+    holding each of the (row, column) points (rows, cols), int arrays, or
+    -1 for those outside all of them. Points on an edge shared by two roots
+    go to the first.
+    """
+    
+    owners = np.full(len(rows), -1)
+    
+    for k in range(len(roots) - 1, -1, -1):
+        a, b, c = roots[k]
+        area = (b[0] - a[0]) * (c[1] - a[1]) - (b[1] - a[1]) * (c[0] - a[0])
+        inside = np.ones(len(rows), dtype=bool)
+        
+        for p, q in ((a, b), (b, c), (c, a)):
+            inside &= ((q[0] - p[0]) * (cols - p[1])
+                       - (q[1] - p[1]) * (rows - p[0])) * area >= 0
+        
+        owners[inside] = k
+    
+    return owners
+
+def lattice_at(grid, lattice, offset, fill):
+    """
+    Returns the values of grid (an array indexed by row and column first)
+    at the points of lattice, a ((row, column), step, (rows, columns))
+    tuple of the first point, the spacing and the numbers of the points,
+    each moved by offset (a (row, column) pair), with fill at those
+    outside the grid
+    """
+    
+    start, step, shape = lattice
+    values = np.full(tuple(shape) + grid.shape[2:], fill, dtype=grid.dtype)
+    spans = []
+    
+    for first, count, length in zip(np.add(start, offset), shape,
+                                    grid.shape):
+        low = max(0, -(first // step))
+        high = min(count, max(0, (length - 1 - first) // step + 1))
+        spans.append((low, high, slice(first + low * step,
+                                       first + high * step, step)))
+    
+    (rowLow, rowHigh, rowSlice), (colLow, colHigh, colSlice) = spans
+    
+    if rowHigh > rowLow and colHigh > colLow:
+        values[rowLow:rowHigh, colLow:colHigh] = grid[rowSlice, colSlice]
+    
+    return values
+
+def bisection_errors(roots, ids, vertices, missing, locked):
+    """
+    Returns the error bound of each point of a grid as the midpoint of the
+    hypotenuses of the triangles it splits (see adaptive_triangulation),
+    in one pass over the points, from those splitting the smallest
+    triangles up. The error of a triangle is the distance from the vertex
+    over its midpoint to the middle of its hypotenuse, and its bound the
+    larger of that and the bounds of the midpoints of its legs (which
+    split its children); the bound of a point is the largest of those of
+    the (one or two) triangles it splits. As each triangle's bound is at
+    least those of the triangles below it, and the two triangles sharing a
+    hypotenuse share its bound, splitting every triangle whose bound is
+    over an error limit makes a mesh without cracks (T-junctions).
+    Missing vertices are not measured, but triangles with both missing and
+    present points, and those with locked points besides their corners,
+    are always split, except where splitting the smallest of them would
+    pinch the solid at a missing point (which is left out instead).
+    
+    Arguments:
+    roots -- (R, 3, 2) int array of root triangles, as for
+             adaptive_triangulation
+    ids -- 2D int array of the index of the point at each (row, column)
+    vertices -- (N, 3) float array of the vertex over each point
+    missing -- (N,) bool array, whether each vertex is missing
+    locked -- (N,) bool array of the points the mesh must keep
+    
+    Return -- float array, the shape of ids, of the error bound at each
+              (row, column) (0 where no triangle is split)
+    """
+    
+    shape = ids.shape
+    rows, cols = np.indices(shape).reshape(2, -1)
+    inside = (root_owners(roots, rows, cols) >= 0).reshape(shape)
+    present = ~missing[ids]
+    lockedPts = locked[ids]
+    errors = np.zeros(shape)
+    
+    # whether any point of the triangles split at each point is present,
+    # and whether any is missing
+    anyPresent = np.zeros(shape, dtype=bool)
+    anyMissing = np.zeros(shape, dtype=bool)
+    
+    size = np.abs(roots[0, 2] - roots[0, 0]).max()
+    hypotenuse = roots[0, 1] - roots[0, 0]
+    step = 2
+    
+    while step <= size:
+        half = step // 2
+        centers = (len(range(half, shape[0], step)),
+                   len(range(half, shape[1], step)))
+        
+        # the squares of each size are split along the diagonal through
+        # the center of the square of twice the size they are in
+        if step < size:
+            i, j = np.indices(centers) % 2
+            mains = i == j
+        else:
+            mains = np.full(centers, hypotenuse[0] * hypotenuse[1] > 0)
+        
+        # the triangles with hypotenuses of length step along the grid
+        # lines are split at the middles of the sides of the squares of
+        # that size, and their parents, with legs of that length, at the
+        # centers of the squares; each as (ends of the hypotenuse, right
+        # angles of the triangles sharing it, and which of the midpoints)
+        up, down = (-half, 0), (half, 0)
+        left, right = (0, -half), (0, half)
+        upLeft, upRight = (-half, -half), (-half, half)
+        downLeft, downRight = (half, -half), (half, half)
+        lattices = [((0, half), [((left, right), (up, down), True)]),
+                    ((half, 0), [((up, down), (left, right), True)]),
+                    ((half, half),
+                     [((upLeft, downRight), (upRight, downLeft), mains),
+                      ((downLeft, upRight), (upLeft, downRight), ~mains)])]
+        
+        for start, kinds in lattices:
+            count = (len(range(start[0], shape[0], step)),
+                     len(range(start[1], shape[1], step)))
+            lattice = (start, step, count)
+            m = vertices[lattice_at(ids, lattice, (0, 0), 0)]
+            mPresent = lattice_at(present, lattice, (0, 0), False)
+            bound = np.zeros(count)
+            hasPresent = np.zeros(count, dtype=bool)
+            hasMissing = np.zeros(count, dtype=bool)
+            
+            for ends, corners, which in kinds:
+                a, b = (vertices[lattice_at(ids, lattice, end, 0)]
+                        for end in ends)
+                aPresent, bPresent = (lattice_at(present, lattice, end,
+                                                 False) for end in ends)
+                own = np.where(mPresent, lengths((a + b) / 2 - m), 0)
+                onEnds = which
+                
+                for end in ends:
+                    onEnds = onEnds & lattice_at(inside, lattice, end, False)
+                
+                for corner in corners:
+                    exists = onEnds & lattice_at(inside, lattice, corner,
+                                                 False)
+                    cornerPresent = lattice_at(present, lattice, corner,
+                                               False)
+                    somePresent = aPresent | bPresent | mPresent \
+                                  | cornerPresent
+                    someMissing = ~(aPresent & bPresent & mPresent
+                                    & cornerPresent)
+                    error = own
+                    
+                    # the midpoints of the legs split the two children
+                    # (legs one point long have none)
+                    for end in ends:
+                        leg = (corner[0] + end[0], corner[1] + end[1])
+                        
+                        if leg[0] % 2 or leg[1] % 2:
+                            continue
+                        
+                        leg = (leg[0] // 2, leg[1] // 2)
+                        error = np.maximum(error, lattice_at(errors, lattice,
+                                                             leg, 0))
+                        somePresent |= lattice_at(anyPresent, lattice, leg,
+                                                  False)
+                        someMissing |= lattice_at(anyMissing, lattice, leg,
+                                                  False)
+                    
+                    error = np.where(somePresent & someMissing, np.inf,
+                                     error)
+                    bound = np.maximum(bound, np.where(exists, error, 0))
+                    hasPresent |= exists & somePresent
+                    hasMissing |= exists & someMissing
+            
+            # splitting the smallest triangles at a missing point on a
+            # grid line can leave an edge between two missing points with
+            # present points on both sides, where the top surface drops to
+            # the bottom from both sides and the solid pinches to an edge;
+            # such a point is left out (the hole shrinks by it) when the
+            # two triangles it would split do not pinch the solid
+            if step == 2 and len(kinds) == 1:
+                ends, corners, which = kinds[0]
+                pts = ends + corners
+                e0, e1, c0, c1 = (lattice_at(present, lattice, pt, False)
+                                  for pt in pts)
+                interior = ~mPresent
+                
+                for pt in pts:
+                    interior &= lattice_at(inside, lattice, pt, False)
+                
+                bound[interior & ((e0 & e1 & ~(c0 & c1))
+                                  | (c0 & c1 & (e0 ^ e1)))] = 0
+            
+            bound[lattice_at(lockedPts, lattice, (0, 0), False)
+                  & (hasPresent | hasMissing)] = np.inf
+            errors[start[0]::step, start[1]::step] = bound
+            anyPresent[start[0]::step, start[1]::step] = hasPresent
+            anyMissing[start[0]::step, start[1]::step] = hasMissing
+        
+        step *= 2
+    
+    return errors
+
+def adaptive_triangulation(roots, ids, vertices, missing, locked, maxError):
+    """
+    Triangulates a grid of vertices adaptively, as a right triangulated
+    irregular network: the root triangles are bisected only where the
+    vertices they leave out are further than maxError from the surface
+    they make, as measured at the midpoints of their hypotenuses (see
+    bisection_errors), so flat and evenly sloped areas take far fewer
+    triangles than in a uniform grid. A triangle (a, b, c), with its
+    hypotenuse from a to b and its right angle at c, is split at the
+    midpoint m of its hypotenuse into (c, a, m) and (b, c, m), which keep
+    its winding, down to triangles with legs one point apart.
+    Locked points, and the edges between missing and present points, are
+    all kept at the full resolution of the grid (but for missing points
+    that would pinch the solid, see bisection_errors).
+    
+    Arguments:
+    roots -- (R, 3, 2) int array of the (row, column) coordinates of the
+             corners (a, b, c) of each root triangle, all the same size
+             and with their legs along the grid lines, as from
+             square_roots or triangle_roots
+    ids -- 2D int array of the index of the point at each (row, column)
+    vertices -- (N, 3) float array of the vertex over each point
+    missing -- (N,) bool array, whether each vertex is missing
+    locked -- (N,) bool array of the points the mesh must keep
+    maxError -- float largest distance allowed between a left out vertex
+                and the surface
+    
+    Return -- (M, 3) int array of the point indices of each triangle, wound
+              as the roots are
+    """
+    
+    errors = bisection_errors(roots, ids, vertices, missing,
+                              locked).ravel()
+    
+    # triangles are followed down from the roots as the positions of their
+    # corners in the grid, row by row, whose midpoints are their means
+    tris = roots[..., 0] * ids.shape[1] + roots[..., 1]
+    levels = 2 * (int(np.abs(roots[0, 2] - roots[0, 0]).max()).bit_length()
+                  - 1)
+    kept = []
+    
+    for level in range(levels):
+        a, b, c = tris[:, 0], tris[:, 1], tris[:, 2]
+        m = (a + b) // 2
+        split = errors[m] > maxError
+        kept.append(tris[~split])
+        a, b, c, m = a[split], b[split], c[split], m[split]
+        tris = np.stack((np.stack((c, a, m), axis=-1),
+                         np.stack((b, c, m), axis=-1)),
+                        axis=1).reshape(-1, 3)
+    
+    kept.append(tris)
+    
+    return ids.ravel()[np.concatenate(kept)]
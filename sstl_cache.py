@@ -0,0 +1,145 @@
+import os
+import sys
+import shutil
+import hashlib
+import numpy as np
+from sstl_image import *
+
+# bump whenever the decoded planes change meaning, so stale entries are
+# never reused
+CACHE_VERSION = 1
+
+class DecodedImageCache():
+    """
+    On-disk cache of decoded image planes (see ImageWrapper.planes), so
+    that runs with the same images can skip decoding them. Each entry is a
+    directory of .npy files, keyed by a hash of the contents of the images
+    and of everything else that affects decoding, and is memory mapped when
+    loaded. The least recently used entries are evicted to keep the cache
+    under a maximum size.
+    """
+    
+    def __init__(self, path, maxSize):
+        """
+        Arguments:
+        path -- directory to keep the cache in (created if needed)
+        maxSize -- maximum total size of the cache in megabytes
+        """
+        
+        self.path = path
+        self.maxBytes = maxSize * 1024 * 1024
+        
+        try:
+            os.makedirs(path, exist_ok=True)
+        except OSError:
+            sys.exit("Error: could not create image cache directory "
+                     + str(path))
+    
+    def key(self, imgPaths, settings):
+        """
+        Returns the cache key for decoding the files at imgPaths (None
+        entries are allowed, for missing optional images) with the given
+        settings (any value with a stable repr, such as weights).
+        """
+        
+        digest = hashlib.sha256(repr((CACHE_VERSION, settings)).encode())
+        
+        for imgPath in imgPaths:
+            if imgPath is None:
+                digest.update(b'\x00')
+                continue
+            
+            try:
+                with open(imgPath, 'rb') as f:
+                    for block in iter(lambda: f.read(1 << 20), b''):
+                        digest.update(block)
+            except OSError:
+                sys.exit("Error: failed to open image at " + imgPath)
+            
+            digest.update(b'\x01')
+        
+        return digest.hexdigest()
+    
+    def load(self, key):
+        """
+        Returns the planes stored under key (as read-only memory mapped
+        arrays), or None if there is no such entry.
+        """
+        
+        entry = os.path.join(self.path, key)
+        
+        if not os.path.isdir(entry):
+            return None
+        
+        try:
+            planes = {}
+            
+            for fileName in os.listdir(entry):
+                if fileName.endswith('.npy'):
+                    planes[fileName[:-4]] = np.load(
+                        os.path.join(entry, fileName), mmap_mode='r')
+            
+            # mark the entry as recently used
+            os.utime(entry)
+        except (OSError, ValueError):
+            return None
+        
+        return planes
+    
+    def store(self, key, planes):
+        """
+        Stores planes (dict of arrays) under key, then evicts the least
+        recently used entries until the cache fits in its maximum size.
+        """
+        
+        entry = os.path.join(self.path, key)
+        tempEntry = entry + ".tmp" + str(os.getpid())
+        
+        try:
+            os.makedirs(tempEntry, exist_ok=True)
+            
+            for name, plane in planes.items():
+                np.save(os.path.join(tempEntry, name + '.npy'), plane)
+            
+            # entries only appear once they are complete
+            os.rename(tempEntry, entry)
+        except OSError:
+            shutil.rmtree(tempEntry, ignore_errors=True)
+            
+            # another run may have stored the same entry first
+            if not os.path.isdir(entry):
+                print("Warning: could not write to image cache at "
+                      + self.path)
+            
+            return
+        
+        self.evict(key)
+    
+    def evict(self, keep=None):
+        """
+        Removes the least recently used entries (other than keep) until the
+        cache is no larger than its maximum size.
+        """
+        
+        entries = []
+        totalSize = 0
+        
+        for name in os.listdir(self.path):
+            entry = os.path.join(self.path, name)
+            
+            if not os.path.isdir(entry) or ".tmp" in name:
+                continue
+            
+            size = sum(os.path.getsize(os.path.join(entry, fileName))
+                       for fileName in os.listdir(entry))
+            entries.append((os.path.getmtime(entry), size, name))
+            totalSize += size
+        
+        for mtime, size, name in sorted(entries):
+            if totalSize <= self.maxBytes:
+                break
+            
+            if name != keep:
+                shutil.rmtree(os.path.join(self.path, name),
+                              ignore_errors=True)
+                totalSize -= size
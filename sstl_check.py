@@ -0,0 +1,228 @@
+import os
+import sys
+import argparse
+import tempfile
+from sstl_main import *
+
+# the shapes checked by default: built-in sphere faces, or "prism"
+CHECK_SHAPES = ["cube", "icosahedron", "rhomb", "prism"]
+
+# the resolutions checked by default (powers of 2, for adaptiveSubdivision);
+# larger ones take much longer, so are only checked when asked for
+CHECK_RESOLUTIONS = [16, 64]
+
+# the options each solid is built with: (name, collapseFlatBottoms,
+# decimation, adaptiveSubdivision), the latter two as the fraction of the
+# maximum altitude given as maxError (or None when not enabled)
+CHECK_OPTIONS = [("uniform", False, None, None),
+                 ("collapsed", True, None, None),
+                 ("decimated", False, 0.002, None),
+                 ("decimated and collapsed", True, 0.002, None),
+                 ("adaptive", False, None, 0.002)]
+
+def check_solid(img, shape, res, collapse, maxError, adaptiveError):
+    """
+    Builds the Sphere (with the built-in faces named shape) or Prism (if
+    shape is "prism") checked at resolution res, with the options given as
+    for CHECK_OPTIONS (maxError and adaptiveError as fractions of the
+    maximum altitude)
+    """
+    
+    maxAltitude = 1 if shape == "prism" else 11
+    
+    if maxError is not None:
+        maxError *= maxAltitude
+    
+    if adaptiveError is not None:
+        adaptiveError *= maxAltitude
+    
+    if shape == "prism":
+        return Prism(img, 1, 1, res, res, 0.5, maxAltitude, False, collapse,
+                     maxError, adaptiveError)
+    
+    faces = faceShapes[shape]
+    pts = [tuple(pt) for pt in faces["pts"]]
+    assembledFaces = [QuadFace([pts[i] for i in quad], res, res, True, False)
+                      for quad in faces["quads"]]
+    assembledFaces += [TriFace([pts[i] for i in tri], res, True, False)
+                       for tri in faces["tris"]]
+    
+    return Sphere(img, projections["equirectangular"], assembledFaces,
+                  faces["normalize"], 9, maxAltitude, 8, None, None, False,
+                  collapse, maxError, adaptiveError)
+
+def read_stl(path):
+    """
+    Returns the (T, 3, 3) float array of the corners of each triangle of
+    the binary STL file at path, and the number of triangles its header
+    gives
+    """
+    
+    with open(path, "rb") as f:
+        f.seek(80)
+        count = int.from_bytes(f.read(4), byteorder="little", signed=False)
+        records = np.frombuffer(f.read(), dtype=STL_RECORD)
+    
+    return np.stack((records["v0"], records["v1"], records["v2"]),
+                    axis=1).astype(np.float64), count
+
+def open_edges(tris):
+    """
+    Returns the number of edges of tris (a (T, 3, 3) float array of the
+    corners of each triangle) that are not shared with exactly one other
+    triangle running the other way, and the number of triangles with
+    corners in the same place: both 0 for a closed, manifold mesh
+    (corners are matched by their exact positions)
+    """
+    
+    corners = tris.reshape(-1, 3)
+    order = np.lexsort(corners.T[::-1])
+    ordered = corners[order]
+    
+    # corners are numbered in sorted order, each one more than the last
+    # unless in the same place
+    ids = np.empty(len(corners), dtype=np.int64)
+    ids[order] = np.cumsum(np.concatenate(([0], np.any(
+        ordered[1:] != ordered[:-1], axis=1))))
+    ids = ids.reshape(-1, 3)
+    n = ids.max() + 1
+    degenerate = np.sum((ids[:, 0] == ids[:, 1]) | (ids[:, 1] == ids[:, 2])
+                        | (ids[:, 2] == ids[:, 0]))
+    u = ids.ravel()
+    v = ids[:, [1, 2, 0]].ravel()
+    keys = np.sort(u * n + v)
+    reverse = np.sort(v * n + u)
+    repeated = np.sum(keys[1:] == keys[:-1])
+    
+    return int(repeated + np.sum(keys != reverse)), int(degenerate)
+
+def solid_volume(tris):
+    """
+    Returns the volume inside tris (a (T, 3, 3) float array of the corners
+    of each triangle of a closed mesh, counterclockwise from outside)
+    """
+    
+    return np.sum(tris[:, 0] * np.cross(tris[:, 1], tris[:, 2])) / 6
+
+def solid_area(tris):
+    """Returns the surface area of tris (as for solid_volume)"""
+    
+    return np.sum(lengths(np.cross(tris[:, 1] - tris[:, 0],
+                                   tris[:, 2] - tris[:, 0]))) / 2
+
+def check_faces(solid, folder, volumes, maxError):
+    """
+    Writes each face of solid (if a Sphere) or solid itself (if a Prism) to
+    an STL file in folder and checks it, returning the list of problems
+    found (empty if none): the mesh must be closed and manifold, have as
+    many triangles as band_triangle_count counts (and as the header of the
+    file gives), and enclose the volume in volumes (a list, one per face),
+    to within maxError over the whole surface if given. volumes is filled
+    in instead when empty.
+    
+    Return -- (problems, tris) tuple: the list of strings describing each
+              problem and the int number of triangles written
+    """
+    
+    faces = solid.faces if isinstance(solid, Sphere) else [None]
+    problems = []
+    total = 0
+    
+    for faceNum, face in enumerate(faces):
+        path = os.path.join(folder, "face" + str(faceNum) + ".stl")
+        counted = count_mesh_tris(solid, face)
+        stl = STLFileWrapper(path, None)
+        write_mesh_tris(solid, stl, face)
+        stl.close()
+        tris, count = read_stl(path)
+        os.remove(path)
+        total += len(tris)
+        name = "face " + str(faceNum) + ": "
+        
+        if counted != len(tris) or count != len(tris):
+            problems.append(name + "counted " + str(counted)
+                            + " triangles but wrote " + str(len(tris))
+                            + " (header " + str(count) + ")")
+        
+        edges, degenerate = open_edges(tris)
+        
+        if edges or degenerate:
+            problems.append(name + str(edges) + " unmatched edges, "
+                            + str(degenerate) + " degenerate triangles")
+        
+        volume = solid_volume(tris)
+        
+        if len(volumes) < len(faces):
+            volumes.append(volume)
+            continue
+        
+        if maxError is None:
+            allowed = 1e-6 * abs(volumes[faceNum])
+        else:
+            allowed = maxError * solid_area(tris)
+        
+        if abs(volume - volumes[faceNum]) > allowed:
+            problems.append(name + "volume " + str(volume) + " instead of "
+                            + str(volumes[faceNum]))
+    
+    return problems, total
+
+def check_meshes(shapes, resolutions):
+    """
+    Checks the meshes of each of shapes (as for CHECK_SHAPES) at each of
+    resolutions with each of CHECK_OPTIONS (see check_faces), built from
+    the example images, printing what was found
+    
+    Return -- int number of checks that found problems
+    """
+    
+    here = os.path.dirname(os.path.abspath(__file__))
+    img = load_image_wrapper({
+        "depthImages": [os.path.join(here, "exampleDepth0.png")],
+        "depthImageWeights": [1],
+        "holeImage": os.path.join(here, "exampleHoles.png"),
+        "colorImage": None})
+    failed = 0
+    
+    with tempfile.TemporaryDirectory() as folder:
+        for shape in shapes:
+            for res in resolutions:
+                volumes = []
+                
+                for name, collapse, maxError, adaptiveError in CHECK_OPTIONS:
+                    solid = check_solid(img, shape, res, collapse, maxError,
+                                        adaptiveError)
+                    error = solid.maxError
+                    
+                    if error is None:
+                        error = solid.adaptiveError
+                    
+                    problems, tris = check_faces(solid, folder, volumes,
+                                                 error)
+                    print(shape + " " + str(res) + " " + name + ": "
+                          + str(tris) + " triangles, "
+                          + ("OK" if not problems else "FAILED"))
+                    
+                    for problem in problems:
+                        print("    " + problem)
+                    
+                    failed += bool(problems)
+    
+    return failed
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Checks that the meshes built of the example images are"
+                    + " closed and manifold, keep their volume and have as"
+                    + " many triangles as are counted for them")
+    parser.add_argument("--shapes", nargs="+", default=CHECK_SHAPES,
+        choices=sorted(faceShapes) + ["prism"],
+        help="built-in sphere faces (or \"prism\") to check")
+    parser.add_argument("--resolutions", nargs="+", type=int,
+        default=CHECK_RESOLUTIONS,
+        help="resolutions to check (powers of 2)")
+    args = parser.parse_args()
+    failed = check_meshes(args.shapes, args.resolutions)
+    
+    if failed:
+        sys.exit("Error: " + str(failed) + " checks found problems")
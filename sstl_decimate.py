@@ -0,0 +1,472 @@
+from sstl_math import *
+
+# the smallest z component of the unit normal of a triangle made by
+# decimating: steeper triangles would hide large height errors, so they
+# are never made, and the height errors of steeper triangles already in the
+# mesh are measured as if they were this steep
+MIN_NORMAL_Z = 0.01
+
+# the number of triangles of a mesh decimated at once: larger meshes are
+# decimated a part at a time (see decimate_mesh), to bound the memory used
+DECIMATE_PART_TRIS = 1 << 18
+
+def height_quadrics(vertices, tris, ids):
+    """
+    Returns the error quadrics of some of the vertices of a mesh: the sum,
+    over the triangles around each vertex, of the outer product of the
+    plane of the triangle with itself. With each plane as (a, b, 1, d) (its
+    normal divided by its z component), p @ Q @ p (for p = (x, y, z, 1)) is
+    the sum of the squared heights (along z) of the point (x, y, z) above
+    or below the planes. Each quadric is symmetric, so only its 10 unique
+    terms are kept: the upper triangle of Q, row by row (see
+    quadric_costs).
+    
+    Arguments:
+    vertices -- (N, 3) float array of vertices
+    tris -- (T, 3) int array of the vertex indices of each triangle
+    ids -- (U,) int array of the vertices to find the quadrics of
+    
+    Return -- (U, 10) float array of quadrics (0 for unused vertices)
+    """
+    
+    slots = np.full(len(vertices), -1)
+    slots[ids] = np.arange(len(ids))
+    quadrics = np.zeros((len(ids), 10))
+    terms = np.triu_indices(4)
+    
+    # a chunk of triangles at a time, to bound the memory used
+    for start in range(0, len(tris), DECIMATE_PART_TRIS):
+        chunk = tris[start:start + DECIMATE_PART_TRIS]
+        pts = vertices[chunk]
+        normals = np.cross(pts[:, 1] - pts[:, 0], pts[:, 2] - pts[:, 0])
+        scales = np.maximum(np.abs(normals[:, 2]),
+                            MIN_NORMAL_Z * lengths(normals))[:, np.newaxis]
+        normals = np.divide(normals, scales, out=np.zeros_like(normals),
+                            where=scales > 0)
+        planes = np.concatenate((normals,
+                                 -np.sum(normals * pts[:, 0], axis=-1,
+                                         keepdims=True)), axis=-1)
+        corners = slots[chunk].ravel()
+        kept = corners >= 0
+        corners = corners[kept]
+        
+        if len(corners) == 0:
+            continue
+        
+        # the vertices of a chunk are mostly near each other
+        first = corners.min()
+        count = corners.max() + 1 - first
+        
+        for k, (i, j) in enumerate(zip(*terms)):
+            quadrics[first:first + count, k] += np.bincount(
+                corners - first,
+                np.repeat(planes[:, i] * planes[:, j], 3)[kept], count)
+    
+    return quadrics
+
+def quadric_costs(quadrics, pts):
+    """
+    Returns p @ Q @ p (for p = (x, y, z, 1)) for each quadric Q (as from
+    height_quadrics) and point (x, y, z) of the (M, 10) and (M, 3) float
+    arrays quadrics and pts
+    """
+    
+    q = quadrics.T
+    x, y, z = pts.T
+    
+    return ((q[0] * x + 2 * (q[1] * y + q[2] * z + q[3])) * x
+            + (q[4] * y + 2 * (q[5] * z + q[6])) * y
+            + (q[7] * z + 2 * q[8]) * z + q[9])
+
+def touching(marked, tris):
+    """
+    Returns the bool array of whether each triangle of tris (a (T, 3) int
+    array of vertex indices) has a vertex in marked (a bool array, one per
+    vertex)
+    """
+    
+    corners = marked[tris]
+    
+    return corners[:, 0] | corners[:, 1] | corners[:, 2]
+
+def spread_minimum(values, tris, steps):
+    """
+    Sets each of the values (an array, one per vertex of a mesh) to the
+    smallest of the values of the vertices within steps edges of it, going
+    along the edges of tris (a (T, 3) int array of the vertex indices of
+    each triangle), in place
+    """
+    
+    for step in range(steps):
+        corners = values[tris]
+        np.minimum.at(values, tris.ravel(),
+                      np.repeat(np.minimum(np.minimum(corners[:, 0],
+                                                      corners[:, 1]),
+                                           corners[:, 2]), 3))
+
+def independent_collapses(tris, u, v, n):
+    """
+    Picks collapses of vertices onto their neighbors that can all be made
+    at once: no two whose edges are within an edge of each other (so no
+    collapse moves a vertex of the triangles, or makes an edge, that
+    another one does). Those first, in order, among all that they would
+    clash with are taken, then those first among the ones left that do not
+    clash with any taken, and so on.
+    
+    Arguments:
+    tris -- (T, 3) int array of the vertex indices of each triangle
+    u, v -- int arrays of the vertices to collapse and what onto, in order
+    n -- int number of vertices
+    
+    Return -- bool array of whether each collapse is taken
+    """
+    
+    count = len(u)
+    taken = np.zeros(count, dtype=bool)
+    left = np.arange(count)
+    firsts = np.full(n, count)
+    reach = np.ones(n, dtype=np.uint8)
+    
+    while len(left) > 0:
+        np.minimum.at(firsts, u[left], left)
+        np.minimum.at(firsts, v[left], left)
+        
+        # only the triangles around the collapses left matter
+        tris = tris[touching(firsts < count, tris)]
+        spread_minimum(firsts, tris, 1)
+        first = left[np.minimum(firsts[u[left]], firsts[v[left]]) == left]
+        taken[first] = True
+        reach[u[first]] = 0
+        reach[v[first]] = 0
+        spread_minimum(reach, tris, 1)
+        left = left[(reach[u[left]] != 0) & (reach[v[left]] != 0)]
+        firsts[tris] = count
+        reach[tris] = 1
+    
+    return taken
+
+def mesh_edges(tris, n, extra=None):
+    """
+    Returns the edges of a mesh both ways round, as the sorted int array of
+    the keys u * n + v of the edges from each vertex u to each neighbor v
+    (n being the number of vertices), including the keys in extra (an int
+    array of keys of more edges) if given
+    """
+    
+    u = tris.ravel()
+    v = tris[:, [1, 2, 0]].ravel()
+    keys = [u * n + v, v * n + u]
+    
+    if extra is not None:
+        keys.append(extra)
+    
+    keys = np.concatenate(keys)
+    keys.sort()
+    
+    return keys[np.r_[True, keys[1:] != keys[:-1]]]
+
+def collapses_valid(vertices, tris, keys, u, v):
+    """
+    Checks collapses of vertices u onto their neighbors v (int arrays), all
+    made at once: that they can be (see independent_collapses) is
+    assumed.
+    A collapse is valid if u and v have no neighbors in common besides the
+    two across the triangles on the edge between them (which keeps the
+    mesh manifold), and no triangle around u turns over (seen from any
+    side, or from above), loses all of its area or becomes steeper than
+    MIN_NORMAL_Z allows once u is moved onto v.
+    
+    Arguments:
+    vertices -- (N, 3) float array of vertices
+    tris -- (T, 3) int array of the vertex indices of each triangle
+    keys -- edges of tris, as from mesh_edges
+    u, v -- int arrays of the vertices to collapse and what onto
+    
+    Return -- bool array of whether each collapse is valid
+    """
+    
+    n = len(vertices)
+    
+    # neighbors of each u are the keys from u * n to u * n + n - 1
+    firsts = np.searchsorted(keys, u * n)
+    counts = np.searchsorted(keys, u * n + n) - firsts
+    which = np.repeat(np.arange(len(u)), counts)
+    neighbors = keys[np.repeat(firsts, counts) + np.arange(len(which))
+                     - np.repeat(np.cumsum(counts) - counts, counts)] % n
+    shared = keys[np.minimum(np.searchsorted(keys, neighbors * n
+                                             + v[which]),
+                             len(keys) - 1)] == neighbors * n + v[which]
+    valid = np.bincount(which, shared, len(u)) == 2
+    
+    target = np.full(n, -1)
+    target[u] = np.arange(len(u))
+    moved = target[tris]
+    rows, corners = np.nonzero(moved >= 0)
+    collapse = moved[rows, corners]
+    before = vertices[tris[rows]]
+    after = before.copy()
+    after[np.arange(len(rows)), corners] = vertices[v[collapse]]
+    
+    # triangles on the edge from u to v are removed rather than moved
+    removed = np.any(tris[rows] == v[collapse][:, np.newaxis], axis=1)
+    oldNormals = np.cross(before[:, 1] - before[:, 0],
+                          before[:, 2] - before[:, 0])
+    newNormals = np.cross(after[:, 1] - after[:, 0],
+                          after[:, 2] - after[:, 0])
+    newAreas = lengths(newNormals)
+    flipped = ~removed & ((np.sum(oldNormals * newNormals, axis=-1) <= 0)
+                          | (np.sign(oldNormals[:, 2]) * newNormals[:, 2]
+                             <= MIN_NORMAL_Z * newAreas)
+                          | (newAreas <= 1e-9 * lengths(oldNormals)))
+    valid[collapse[flipped]] = False
+    
+    return valid
+
+def decimate_part(points, tris, fixed, quadrics, selfCosts, extra, limit):
+    """
+    Decimates part of a mesh (see decimate_mesh), in rounds: in each round,
+    the cheapest collapse of each vertex is found, and as many of those
+    within limit as can be made at once are made, cheapest first (see
+    independent_collapses). Collapses that are not valid (see
+    collapses_valid) are not tried again.
+    
+    Arguments:
+    points -- (N, 3) float array of the vertices of the part
+    tris -- (T, 3) int array of the vertex indices of each triangle
+    fixed -- (N,) bool array of the vertices that must not be removed
+    quadrics -- (N, 10) float array of the quadric of each vertex (see
+                height_quadrics), updated in place as vertices are merged
+    selfCosts -- (N,) float array of the cost (the summed squared height
+                 error) of each vertex where it is, updated in place
+    extra -- int array of the keys (as from mesh_edges) of the edges
+             between fixed vertices that the rest of the mesh has
+    limit -- float largest cost allowed
+    
+    Return -- (tris, rows) tuple: the (T', 3) int array of the vertex
+              indices of each triangle left, and the int array of the row
+              of tris each came from
+    """
+    
+    n = len(points)
+    rows = np.arange(len(tris))
+    blocked = np.zeros(0, dtype=np.int64)
+    bestCosts = np.full(n, np.inf)
+    bestTargets = np.zeros(n, dtype=tris.dtype)
+    
+    # the cheapest collapse of a vertex only changes when the mesh around
+    # it does: after the first round, only the vertices that were merged
+    # into, or whose cheapest collapse was onto a vertex that was merged or
+    # removed, are looked at again, and the others next to a vertex that
+    # was merged into only have their collapse onto it to look at (so only
+    # the triangles within an edge of these, or of the vertices with cheap
+    # enough collapses, are needed)
+    stale = ~fixed
+    merged = np.zeros(n, dtype=bool)
+    
+    while True:
+        near = stale | merged | (bestCosts <= limit)
+        
+        if not near.any():
+            break
+        
+        near[tris[touching(near, tris)]] = True
+        work = touching(near, tris)
+        local = tris[work]
+        
+        # each vertex that can be removed is inside the mesh, so the edge
+        # to each of its neighbors is on exactly one triangle this way round
+        u = local.ravel()
+        v = local[:, [1, 2, 0]].ravel()
+        candidates = np.flatnonzero((stale[u] | merged[v]) & ~fixed[u])
+        cu = u[candidates]
+        cv = v[candidates]
+        
+        if len(blocked) > 0:
+            keys = cu * n + cv
+            tried = blocked[np.minimum(np.searchsorted(blocked, keys),
+                                       len(blocked) - 1)] == keys
+            cu = cu[~tried]
+            cv = cv[~tried]
+        
+        # the cheapest collapse of each of them (the first of equals)
+        costs = (quadric_costs(quadrics.take(cu, axis=0),
+                               points.take(cv, axis=0)) + selfCosts[cv])
+        bestCosts[stale] = np.inf
+        np.minimum.at(bestCosts, cu, costs)
+        ties = np.flatnonzero(costs == bestCosts[cu])
+        firsts = np.full(n, len(cu))
+        np.minimum.at(firsts, cu[ties], ties)
+        cheapest = firsts[firsts < len(cu)]
+        bestTargets[cu[cheapest]] = cv[cheapest]
+        stale[:] = False
+        merged[:] = False
+        
+        cu = np.flatnonzero(bestCosts <= limit)
+        
+        if len(cu) == 0:
+            break
+        
+        order = np.argsort(bestCosts[cu], kind="stable")
+        cu = cu[order]
+        cv = bestTargets[cu]
+        taken = independent_collapses(local, cu, cv, n)
+        cu = cu[taken]
+        cv = cv[taken]
+        
+        # only the edges around the vertices of the collapses are needed to
+        # check them
+        near[:] = False
+        near[cu] = True
+        near[cv] = True
+        around = local[touching(near, local)]
+        keys = mesh_edges(around, n,
+                          extra[near[extra // n] | near[extra % n]])
+        valid = collapses_valid(points, around, keys, cu, cv)
+        blocked = np.sort(np.concatenate((blocked, (cu * n + cv)[~valid])))
+        stale[cu[~valid]] = True
+        cu = cu[valid]
+        cv = cv[valid]
+        
+        target = np.arange(n)
+        target[cu] = cv
+        local = target[local]
+        kept = ((local[:, 0] != local[:, 1]) & (local[:, 1] != local[:, 2])
+                & (local[:, 2] != local[:, 0]))
+        tris = np.concatenate((tris[~work], local[kept]))
+        rows = np.concatenate((rows[~work], rows[work][kept]))
+        
+        # with the cost of each vertex where it is as its own quadric's,
+        # the cost of a vertex that others are merged into is the cost of
+        # the collapse
+        quadrics[cv] += quadrics[cu]
+        selfCosts[cv] = bestCosts[cu]
+        bestCosts[cu] = np.inf
+        merged[cv] = True
+        near[:] = False
+        near[cu] = True
+        near[cv] = True
+        stale |= merged | (near[bestTargets] & (bestCosts < np.inf))
+        stale &= ~fixed
+    
+    return tris, rows
+
+def decimate_mesh(vertices, tris, locked, maxError, rest=None):
+    """
+    Simplifies a height field mesh (a surface over the xy plane, with
+    heights along z) by collapsing vertices onto their neighbors (half
+    edge collapses, so the vertices left keep their places) for as long as
+    the height error they add stays within maxError. The error of a
+    collapse is measured with quadrics (see height_quadrics): the vertex
+    left must be within maxError, in height, of the planes of all of the
+    original triangles around the vertices merged into it (as the square
+    root of the sum of its squared heights above or below them).
+    A large mesh is decimated a part at a time (see decimate_part), each
+    part being the triangles whose first vertex (by index) is in a range,
+    decimated along with the parts next to it: vertices of the part whose
+    neighbors have triangles in other parts are left where they are while
+    it is decimated.
+    
+    Arguments:
+    vertices -- (N, 3) float array of vertices
+    tris -- (T, 3) int array of the vertex indices of each triangle
+    locked -- (N,) bool array of the vertices that must not be removed
+              (such as those on the boundary of the mesh)
+    maxError -- float largest height error allowed
+    rest -- (R, 3) int array of the vertex indices of each triangle of the
+            rest of the mesh, which is left as it is (it must only use
+            locked vertices), or None. No collapse may make an edge
+            between two vertices that the rest of the mesh already has an
+            edge between, as then more than two triangles would share it.
+    
+    Return -- (T', 3) int array of the vertex indices of each triangle
+              left, into the same vertices
+    """
+    
+    n = len(vertices)
+    unlocked = np.flatnonzero(~locked)
+    slots = np.full(n, -1)
+    slots[unlocked] = np.arange(len(unlocked))
+    quadrics = height_quadrics(vertices, tris, unlocked)
+    selfCosts = np.zeros(n)
+    limit = maxError * maxError
+    restKeys = np.zeros(0, dtype=np.int64)
+    
+    if rest is not None:
+        used = np.zeros(n, dtype=bool)
+        used[tris] = True
+        restKeys = mesh_edges(rest[used[rest].sum(axis=1) >= 2], n)
+        restKeys = restKeys[used[restKeys // n] & used[restKeys % n]]
+    
+    # the triangles of each part, in order of their first vertices
+    partCount = -(-len(tris) // DECIMATE_PART_TRIS)
+    firsts = tris.min(axis=1)
+    parts = firsts * partCount // (firsts.max(initial=0) + 1)
+    order = np.argsort(parts, kind="stable")
+    bounds = np.searchsorted(parts[order], np.arange(partCount + 1))
+    partTris = [tris[order[bounds[k]:bounds[k + 1]]]
+                for k in range(partCount)]
+    uses = np.bincount(tris.ravel(), minlength=n)
+    counts = np.zeros(n, dtype=uses.dtype)
+    free = np.zeros(n, dtype=bool)
+    index = np.full(n, -1)
+    del tris, firsts, parts, order
+    
+    for part in range(partCount):
+        window = range(max(part - 1, 0), min(part + 2, partCount))
+        nearby = np.concatenate([partTris[k] for k in window])
+        labels = np.repeat(window, [len(partTris[k]) for k in window])
+        
+        # a vertex of the part can only be removed if all of the triangles
+        # around it and its neighbors are among those of the parts next to
+        # it, so that they are all at hand
+        np.add.at(counts, nearby.ravel(), 1)
+        away = counts[nearby] < uses[nearby]
+        counts[nearby] = 0
+        own = partTris[part]
+        free[own] = ~locked[own]
+        free[nearby[away[:, 0] | away[:, 1] | away[:, 2]]] = False
+        inside = touching(free, nearby)
+        index[nearby[inside]] = 0
+        ids = np.flatnonzero(index >= 0)
+        index[ids] = np.arange(len(ids))
+        
+        # edges of the rest of the mesh (and of the triangles outside the
+        # part) between vertices of the part are only between its fixed
+        # vertices, but the collapses must not make them again
+        outside = nearby[~inside]
+        edges = np.concatenate((outside[:, [0, 1]], outside[:, [1, 2]],
+                                outside[:, [2, 0]]))
+        edges = index[edges[(index[edges] >= 0).all(axis=1)]]
+        starts = np.searchsorted(restKeys, ids * n)
+        ends = np.searchsorted(restKeys, ids * n + n)
+        keys = restKeys[np.repeat(starts - np.cumsum(ends - starts)
+                                  + ends - starts, ends - starts)
+                        + np.arange(np.sum(ends - starts))]
+        keys = index[np.stack((keys // n, keys % n), axis=-1)]
+        edges = np.concatenate((edges, keys[keys[:, 1] >= 0]))
+        extra = np.concatenate((edges[:, 0] * len(ids) + edges[:, 1],
+                                edges[:, 1] * len(ids) + edges[:, 0]))
+        
+        hasQuadric = slots[ids] >= 0
+        partQuadrics = np.zeros((len(ids), 10))
+        partQuadrics[hasQuadric] = quadrics[slots[ids[hasQuadric]]]
+        partCosts = selfCosts[ids]
+        kept, rows = decimate_part(vertices[ids], index[nearby[inside]],
+                                   ~free[ids], partQuadrics, partCosts,
+                                   extra, limit)
+        quadrics[slots[ids[hasQuadric]]] = partQuadrics[hasQuadric]
+        selfCosts[ids] = partCosts
+        kept = ids[kept]
+        np.add.at(uses, nearby[inside].ravel(), -1)
+        np.add.at(uses, kept.ravel(), 1)
+        keptLabels = labels[inside][rows]
+        outsideLabels = labels[~inside]
+        
+        for k in window:
+            partTris[k] = np.concatenate((outside[outsideLabels == k],
+                                          kept[keptLabels == k]))
+        
+        free[nearby] = False
+        index[ids] = -1
+    
+    return np.concatenate(partTris)
@@ -1,12 +1,21 @@
+import os
 import sys
+import numpy as np
 from PIL import Image
 from sstl_math import *
 
 Image.MAX_IMAGE_PIXELS = 268435456
 
-IMAGE_MODES_TO_CONVERT = ('P', 'CMYK, YcbCr, LAB, HSV')
-IMAGE_MODES_TO_CONVERT_ALPHA = ('PA')
-PIXEL_MAXES = {'1': 1, 'L': 255, 'LA': 255, 'RGB': 255, 'RGBA': 255}
+IMAGE_MODES_TO_CONVERT = ('P', 'CMYK', 'YCbCr', 'LAB', 'HSV')
+IMAGE_MODES_TO_CONVERT_ALPHA = ('PA',)
+# 32-bit integer (I) images are scaled by the full int32 range, as int32
+# .npy and .raw files are (see array_to_depth), and float (F) images are
+# expected to already be in the range [0, 1]
+PIXEL_MAXES = {'1': 1, 'L': 255, 'LA': 255, 'RGB': 255, 'RGBA': 255,
+               'I;16': 65535, 'I;16L': 65535, 'I;16B': 65535, 'I;16N': 65535,
+               'I': np.iinfo(np.int32).max, 'F': 1}
+ARRAY_IMAGE_EXTENSIONS = ('.npy', '.raw')
+STL_COLOR_MODES = ('RGB', 'BGR')
 
 def rgb_to_luma(rgb):
     """
@@ -16,6 +25,260 @@ def rgb_to_luma(rgb):
     
     return (rgb[0] * 299 + rgb[1] * 587 + rgb[2] * 114) / 1000
 
+def pack_stl_colors(rgb, colorMode):
+    """
+    Packs 8-bit colors into the 15-bit color attribute words used by the
+    STL format.
+    
+    Arguments:
+    rgb -- uint8 arraylike with a last axis of length 3 (r, g, b)
+    colorMode -- 'RGB' or 'BGR' (the two STL color conventions); any
+                 other value results in words of 0 (no color)
+    
+    Return -- uint16 array with the shape of rgb minus its last axis
+    """
+    
+    rgb = np.asarray(rgb, dtype=np.uint16) >> 3
+    r = rgb[..., 0]
+    g = rgb[..., 1]
+    b = rgb[..., 2]
+    
+    if colorMode == "BGR":
+        return (b << 10) | (g << 5) | r
+    elif colorMode == "RGB":
+        return (r << 10) | (g << 5) | b | (1 << 15)
+    else:
+        return np.zeros(r.shape, dtype=np.uint16)
+
+def image_to_luma(img):
+    """
+    Converts a PIL image (of a mode in PIXEL_MAXES) to a float32 array of
+    luma values scaled to the range [0, 1], indexed [y, x]. Uses the same
+    weights as rgb_to_luma for color images.
+    """
+    
+    data = np.asarray(img, dtype=np.float64)
+    
+    if img.mode == 'RGB' or img.mode == 'RGBA':
+        luma = (data[..., 0] * 299 + data[..., 1] * 587
+                + data[..., 2] * 114) / 1000
+    elif img.mode == 'LA':
+        luma = data[..., 0]
+    else: # 1, L, I;16, I, F
+        luma = data
+    
+    return (luma / PIXEL_MAXES[img.mode]).astype(np.float32)
+
+def array_to_depth(data):
+    """
+    Converts a numeric heightmap array (indexed [y, x], optionally with a
+    trailing channel axis) to float32 heights. Integer arrays are scaled
+    by the maximum of their type to the range [0, 1], float arrays are
+    taken as already being in that range, and color channels are combined
+    to luma as in rgb_to_luma.
+    """
+    
+    data = np.asarray(data)
+    
+    if data.ndim == 3:
+        if data.shape[2] >= 3:
+            data = (data[..., 0] * 299.0 + data[..., 1] * 587.0
+                    + data[..., 2] * 114.0) / 1000
+        else:
+            data = data[..., 0]
+    
+    if np.issubdtype(data.dtype, np.integer):
+        return (data / np.iinfo(data.dtype).max).astype(np.float32)
+    else:
+        return data.astype(np.float32)
+
+def downsample(data, factor):
+    """
+    Shrinks an image array (indexed [y, x], optionally with a trailing
+    channel axis) by the int factor, averaging each factor by factor block
+    of pixels (a box filter). The last row and column are repeated to fill
+    out partial blocks at the edges. The result is float32.
+    """
+    
+    height, width = data.shape[:2]
+    newHeight = -(-height // factor)
+    newWidth = -(-width // factor)
+    padding = [(0, newHeight * factor - height),
+               (0, newWidth * factor - width)]
+    data = np.pad(np.asarray(data, dtype=np.float32),
+                  padding + [(0, 0)] * (np.ndim(data) - 2), mode='edge')
+    return data.reshape((newHeight, factor, newWidth, factor)
+                        + data.shape[2:]).mean(axis=(1, 3))
+
+def draft_image(img, reduce):
+    """
+    Prepares a freshly opened (not yet decoded) PIL image to be shrunk by
+    the int factor reduce. Formats whose decoders can scale while decoding
+    (JPEG, by 1/2, 1/4 or 1/8) are set to decode at the largest of those
+    scales that divides reduce, which is much faster and uses much less
+    memory; any other image decodes at full size. Either way, the caller
+    is left to shrink the decoded image by the factor returned, so that it
+    ends up reduce times smaller in all.
+    
+    Return -- int factor the decoded image still has to be shrunk by
+    """
+    
+    if reduce <= 1:
+        return 1
+    
+    size = img.size
+    scale = min(reduce & -reduce, 8)
+    
+    if scale > 1:
+        img.draft(img.mode, (-(-size[0] // scale), -(-size[1] // scale)))
+    
+    # the decoder may not have scaled the image (or not as far as asked)
+    while scale > 1 and img.size != (-(-size[0] // scale),
+                                     -(-size[1] // scale)):
+        scale //= 2
+    
+    return reduce // scale
+
+def downsample_planes(planes):
+    """
+    Returns decoded image planes (as returned by ImageWrapper.planes) box
+    filtered to half of their size. A pixel of the result is a hole if most
+    of the pixels it covers are.
+    """
+    
+    holeSize = planes["holeSize"]
+    holes = np.unpackbits(planes["holes"], axis=1, count=int(holeSize[0]))
+    holes = downsample(holes, 2) > 0.5
+    result = {"depth": downsample(planes["depth"], 2),
+              "holes": np.packbits(holes, axis=1),
+              "holeSize": np.array((holes.shape[1], holes.shape[0]))}
+    
+    if "color" in planes:
+        result["color"] = np.round(downsample(planes["color"], 2)).astype(
+            np.uint8)
+    
+    return result
+
+def load_heightmap(imgPath, rawWidth=None, rawHeight=None, rawDtype=None,
+                   reduce=1):
+    """
+    Opens and decodes a heightmap.
+    
+    Arguments:
+    imgPath -- Path to the heightmap. Either an image of PIL type 1, L, LA,
+               RGB, RGBA, I;16, I, F, P, PA, CMYK, YCbCr, LAB, or HSV, a
+               .npy file, or a headerless .raw file (see array_to_depth for
+               how the values of .npy and .raw files are scaled).
+    rawWidth, rawHeight -- int dimensions of a .raw file in pixels
+    rawDtype -- numpy dtype string of the samples in a .raw file
+    reduce -- int factor to shrink the heightmap by (see draft_image),
+              default 1 (full size)
+    
+    Return -- (depth, alpha) tuple of float32 arrays (range [0, 1],
+              indexed [y, x]), alpha being None when the heightmap has no
+              alpha channel
+    """
+    
+    ext = os.path.splitext(imgPath)[1].lower()
+    
+    if ext in ARRAY_IMAGE_EXTENSIONS:
+        try:
+            if ext == '.npy':
+                data = np.load(imgPath)
+            elif rawWidth is None or rawHeight is None or rawDtype is None:
+                sys.exit("Error: rawWidth, rawHeight and rawDtype must be"
+                         + " given to read " + imgPath)
+            else:
+                data = np.fromfile(imgPath, dtype=rawDtype)
+                data = data.reshape((rawHeight, rawWidth) + data.shape[1:])
+        except (OSError, ValueError) as e:
+            sys.exit("Error: failed to open heightmap at " + imgPath + " ("
+                     + str(e) + ")")
+        
+        if reduce > 1:
+            return downsample(array_to_depth(data), reduce), None
+        else:
+            return array_to_depth(data), None
+    
+    try:
+        img = Image.open(imgPath)
+    except:
+        sys.exit("Error: failed to open image at " + imgPath)
+    
+    factor = draft_image(img, reduce)
+    
+    if img.mode in IMAGE_MODES_TO_CONVERT:
+        img = img.convert('RGB')
+    elif img.mode in IMAGE_MODES_TO_CONVERT_ALPHA:
+        img = img.convert('RGBA')
+    
+    if not (img.mode in PIXEL_MAXES):
+        sys.exit("Error: image at " + imgPath + " is an unsupported mode, "
+                 + img.mode)
+    
+    depth = image_to_luma(img)
+    alpha = None
+    
+    if img.mode == 'LA' or img.mode == 'RGBA':
+        alpha = image_to_alpha(img)
+    
+    if factor > 1:
+        depth = downsample(depth, factor)
+        
+        if alpha is not None:
+            alpha = downsample(alpha, factor)
+    
+    return depth, alpha
+
+def image_to_alpha(img):
+    """
+    Returns the alpha channel of a PIL image (of a mode in PIXEL_MAXES) as
+    a float32 array scaled to the range [0, 1], indexed [y, x]. Images
+    without an alpha channel are fully opaque (all ones).
+    """
+    
+    if img.mode == 'LA' or img.mode == 'RGBA':
+        data = np.asarray(img.getchannel('A'), dtype=np.float32)
+        return data / PIXEL_MAXES[img.mode]
+    else:
+        return np.ones((img.size[1], img.size[0]), dtype=np.float32)
+
+def resample_nearest(data, size):
+    """
+    Resamples an image array (indexed [y, x]) onto a grid of the given
+    (width, height) size, taking for each new pixel the old pixel under its
+    center. When the new size is an integer multiple of the old one, every
+    lookup into the result matches the same lookup into the original.
+    """
+    
+    height, width = data.shape[:2]
+    
+    if (width, height) == tuple(size):
+        return data
+    
+    x = ((np.arange(size[0]) + 0.5) * width / size[0]).astype(np.intp)
+    y = ((np.arange(size[1]) + 0.5) * height / size[1]).astype(np.intp)
+    return data[y[:, np.newaxis], x]
+
+def locs_to_pixels(u, v, size):
+    """
+    Converts arrays of image coordinates (range [0, 1]) to integer pixel
+    column and row arrays for an image of the given size, following the
+    same rules as the single point lookups: u wraps around the image and v
+    is clamped to the last row.
+    
+    Arguments:
+    u -- float arraylike, horizontal image coordinates
+    v -- float arraylike, vertical image coordinates (same shape as u)
+    size -- (width, height) of the image
+    
+    Return -- (x, y) tuple of integer arrays with the shape of u
+    """
+    
+    x = np.floor(np.asarray(u, dtype=np.float64) * size[0]).astype(np.intp)
+    y = np.floor(np.asarray(v, dtype=np.float64) * size[1]).astype(np.intp)
+    return x % size[0], np.clip(y, 0, size[1] - 1)
+
 class ImageWrapper():
     """
     Contains a height map image, and optionally, an image to act as an
@@ -30,118 +293,283 @@ class ImageWrapper():
     kind of confusing...
     """
     
-    def __init__(self, imgPath, alphaPath=None, colorPath=None):
+    def __init__(self, imgPath, alphaPath=None, colorPath=None,
+                 rawWidth=None, rawHeight=None, rawDtype=None, reduce=1):
         """
         Opens and prepares images to be used for height map
         
         Arguments:
         imgPath -- Path to the base heightmap image. The image must be of PIL
-                   type 1, L, LA, RGB, RGBA, P, PA, CMYK, YcbCr, LAB, or HSV,
+                   type 1, L, LA, RGB, RGBA, I;16, I, F, P, PA, CMYK, YCbCr,
+                   LAB, or HSV, or a .npy or .raw file (see load_heightmap),
                    and if it is a type with an alpha channel, it will
-                   contribute to hole placement.
+                   contribute to hole placement. 16-bit and float images give
+                   full precision from a single image.
         alphaPath -- Path to image that must be one of the same allowable types
                      as for imgPath. Determines hole locations (if luma under
                      half the image maximum at a point, it is a hole). If this
                      image has an alpha channel, it is ignored ("alpha" is 
                      only sourced from image luma.)
+        rawWidth, rawHeight, rawDtype -- layout of a .raw heightmap (see
+                                         load_heightmap)
+        reduce -- int factor to shrink all of the images by as they are
+                  decoded (see draft_image), default 1 (full size)
         """
         
-        try:
-            self.img = Image.open(imgPath)
-        except:
-            print("Error: failed to open image at " + imgPath)
-        
-        if self.img.mode in IMAGE_MODES_TO_CONVERT:
-            self.img = self.img.convert('RGB')
-        elif self.img.mode in IMAGE_MODES_TO_CONVERT_ALPHA:
-            self.img = self.img.convert('RGBA')
-        
-        if not (self.img.mode in PIXEL_MAXES):
-            sys.exit("Error: image at " + imgPath + "is an unsupported mode, "
-                     + self.img.mode)
+        # decode the heightmap once up front; all height lookups are then
+        # plain array indexing
+        self.depth, baseAlpha = load_heightmap(imgPath, rawWidth, rawHeight,
+                                               rawDtype, reduce)
+        self.size = (self.depth.shape[1], self.depth.shape[0])
+        self.mipLevels = []
         
-        self.alpha = None
+        alpha = None
         
         if alphaPath is not None:
             try:
-                self.alpha = Image.open(alphaPath)
+                alpha = Image.open(alphaPath)
             except:
                 print("Error: failed to open image at " + alphaPath)
             
-            self.alpha = self.alpha.convert('L')
+            factor = draft_image(alpha, reduce)
+            alpha = alpha.convert('L').reduce(factor)
         
-        self.color = None
+        self.build_hole_mask(baseAlpha, alpha)
         
-        if colorPath is not None:
-            try:
-                self.color = Image.open(colorPath)
-            except:
-                print("Error: failed to open image at " + colorPath)
-            
-            self.color = self.color.convert('RGB')
+        self.load_color(colorPath, reduce)
+    
+    @classmethod
+    def from_planes(cls, planes):
+        """
+        Creates an ImageWrapper directly from already decoded planes (as
+        returned by planes()) without opening or decoding any images.
+        """
+        
+        wrapper = ImageWrapper.__new__(ImageWrapper)
+        wrapper.depth = planes["depth"]
+        wrapper.size = (wrapper.depth.shape[1], wrapper.depth.shape[0])
+        wrapper.mipLevels = []
+        wrapper.holes = planes["holes"]
+        wrapper.holeSize = tuple(int(n) for n in planes["holeSize"])
+        wrapper.hasHoles = bool(wrapper.holes.any())
+        wrapper.color = planes.get("color")
+        wrapper.colorWords = {}
+        
+        if wrapper.color is not None:
+            wrapper.colorSize = (wrapper.color.shape[1],
+                                 wrapper.color.shape[0])
+        
+        return wrapper
+    
+    def planes(self):
+        """
+        Returns the decoded height, hole and color planes as a dict of
+        arrays, from which from_planes can rebuild an equivalent wrapper.
+        """
+        
+        planes = {"depth": self.depth, "holes": self.holes,
+                  "holeSize": np.array(self.holeSize)}
+        
+        if self.color is not None:
+            planes["color"] = self.color
+        
+        return planes
+    
+    def mip_level_count(self):
+        """
+        Returns the number of mip levels (see mip), from the full size
+        images down to a heightmap of a single pixel
+        """
+        
+        return (max(self.size) - 1).bit_length() + 1
+    
+    def mip(self, level):
+        """
+        Returns an ImageWrapper for mip level `level` of this one. Level 0
+        is this wrapper, and each level after it is half the size of the
+        one before (box filtered, so lookups into it are prefiltered rather
+        than aliased). Levels are built the first time they are asked for,
+        and levels past the last one give the last one.
+        """
+        
+        level = min(level, self.mip_level_count() - 1)
+        
+        while len(self.mipLevels) < level:
+            prev = self.mip(len(self.mipLevels))
+            self.mipLevels.append(ImageWrapper.from_planes(
+                downsample_planes(prev.planes())))
+        
+        if level <= 0:
+            return self
+        else:
+            return self.mipLevels[level - 1]
+    
+    def level_for_spacing(self, spacing):
+        """
+        Returns the mip level to sample at for lookups spacing pixels (of
+        the full size heightmap) apart: the smallest level whose pixels are
+        no larger than the spacing, so neighboring lookups still land on
+        different pixels.
+        """
+        
+        if spacing < 2:
+            return 0
+        
+        return min(int(np.log2(spacing)), self.mip_level_count() - 1)
     
     def depth_luma_at_pixel(self, loc):
         """Returns the luma value at the pixel coordinates in loc."""
         
-        if self.img.mode == 'RGB' or self.img.mode == 'RGBA':
-            return rgb_to_luma(self.img.getpixel(loc)) \
-                / PIXEL_MAXES[self.img.mode]
-        elif self.images[img].mode == 'LA':
-            return self.img.getpixel(loc)[0] / PIXEL_MAXES[self.img.mode]
-        else: #L
-            return self.img.getpixel(loc) / PIXEL_MAXES[self.img.mode]
+        return float(self.depth[int(loc[1]), int(loc[0])])
+    
+    def height_at_locs(self, u, v, level=0):
+        """
+        Returns an array of heights (luma values, range [0, 1]) at the
+        coordinates given by the arrays u and v (range [0, 1]), sampled
+        from the given mip level (see mip)
+        """
+        
+        if level > 0:
+            return self.mip(level).height_at_locs(u, v)
+        
+        x, y = locs_to_pixels(u, v, self.size)
+        return self.depth[y, x]
     
-    def height_at_loc(self, loc):
+    def height_at_loc(self, loc, level=0):
         """
         Returns the height (luma value) at the coordinates in loc
         (range [0, 1])
         """
         
-        size = self.img.size
-        x = floor(loc[0] * size[0]) % size[0]
-        y = min(floor(loc[1] * size[1]), nextafter(size[1], -inf))
-        return self.depth_luma_at_pixel((x, y))
+        return float(self.height_at_locs(loc[0], loc[1], level))
     
-    def hole_at_loc(self, loc):
+    def build_hole_mask(self, baseAlpha, alpha):
         """
-        Returns whether there is a hole at the coordinates in loc
-        (range [0, 1]), determined by the alpha channel in self.img
-        and the luma in alphaImg, if present (if either is below 0.5
-        times its maximum value.)
+        Combines the heightmap's alpha plane and the "alpha" image into a
+        single bit-packed boolean hole mask (self.holes), so hole lookups
+        are one indexed load. The mask grid is large enough for both inputs
+        so neither loses detail.
+        
+        Arguments:
+        baseAlpha -- float array (range [0, 1]) of heightmap alpha values on
+                     the self.size grid, or None if the heightmap has no
+                     alpha channel
+        alpha -- PIL image of mode L determining hole locations, or None
         """
         
-        alphaImgAlpha = 1
-        baseImgAlpha = 1
+        if baseAlpha is None:
+            holes = np.zeros((1, 1), dtype=bool)
+        else:
+            holes = baseAlpha < 0.5
         
-        size = self.img.size
-        x = floor(loc[0] * size[0]) % size[0]
-        y = min(floor(loc[1] * size[1]), nextafter(size[1], -inf))
+        if alpha is not None:
+            size = (max(holes.shape[1], alpha.size[0]),
+                    max(holes.shape[0], alpha.size[1]))
+            holes = resample_nearest(holes, size) \
+                    | resample_nearest(image_to_luma(alpha) < 0.5, size)
         
-        if self.img.mode == 'LA':
-            baseImgAlpha = self.img.getpixel((x,y))[1] \
-                           / PIXEL_MAXES[self.img.mode]
-        elif self.img.mode == 'RGBA':
-            baseImgAlpha = self.img.getpixel((x,y))[3]  \
-                           / PIXEL_MAXES[self.img.mode]
+        self.holeSize = (holes.shape[1], holes.shape[0])
+        self.hasHoles = bool(holes.any())
+        self.holes = np.packbits(holes, axis=1)
+    
+    def holes_at_locs(self, u, v, level=0):
+        """
+        Returns a boolean array of whether there is a hole at each of the
+        coordinates given by the arrays u and v (range [0, 1]), sampled
+        from the given mip level. See hole_at_loc for how holes are
+        determined.
+        """
+        
+        if level > 0 and self.hasHoles:
+            return self.mip(level).holes_at_locs(u, v)
+        
+        if not self.hasHoles:
+            return np.zeros(np.shape(u), dtype=bool)
+        
+        x, y = locs_to_pixels(u, v, self.holeSize)
+        return ((self.holes[y, x >> 3] >> (7 - (x & 7))) & 1).astype(bool)
+    
+    def hole_at_loc(self, loc, level=0):
+        """
+        Returns whether there is a hole at the coordinates in loc
+        (range [0, 1]), determined by the alpha channel of the heightmap
+        and the luma in the "alpha" image, if present (if either is below
+        0.5 times its maximum value.)
+        """
         
-        if self.alpha is not None:
-            size = self.alpha.size
-            x = floor(loc[0] * size[0]) % size[0]
-            y = min(floor(loc[1] * size[1]), nextafter(size[1], -inf))
+        return bool(self.holes_at_locs(loc[0], loc[1], level))
+    
+    def load_color(self, colorPath, reduce=1):
+        """
+        Opens the color image at colorPath (or sets no color, if None) and
+        decodes it to an RGB array, shrunk by the int factor reduce (see
+        draft_image). Packed STL color words for each color mode are made
+        from it the first time they are asked for.
+        """
+        
+        self.color = None
+        self.colorWords = {}
+        
+        if colorPath is not None:
+            try:
+                color = Image.open(colorPath)
+            except:
+                print("Error: failed to open image at " + colorPath)
             
-            alphaImgAlpha = self.alpha.getpixel((x,y)) \
-                            / PIXEL_MAXES[self.alpha.mode] 
+            factor = draft_image(color, reduce)
+            self.color = np.asarray(color.convert('RGB').reduce(factor))
+            self.colorSize = (self.color.shape[1], self.color.shape[0])
+    
+    def colors_at_locs(self, u, v, colorMode, level=0):
+        """
+        Returns a uint16 array of STL color attribute words (see
+        pack_stl_colors) at the coordinates given by the arrays u and v
+        (range [0, 1]), sampled from the given mip level. The words are all
+        0 if there is no color image.
+        """
         
-        return alphaImgAlpha < 0.5 or baseImgAlpha < 0.5
+        if self.color is None or colorMode not in STL_COLOR_MODES:
+            return np.zeros(np.shape(u), dtype=np.uint16)
+        
+        if level > 0:
+            return self.mip(level).colors_at_locs(u, v, colorMode)
+        
+        if colorMode not in self.colorWords:
+            self.colorWords[colorMode] = pack_stl_colors(self.color,
+                                                         colorMode)
+        
+        x, y = locs_to_pixels(u, v, self.colorSize)
+        return self.colorWords[colorMode][y, x]
+    
+    def rgbs_at_locs(self, u, v, level=0):
+        """
+        Returns a uint8 array of colors (with a last axis of r, g, b) at the
+        coordinates given by the arrays u and v (range [0, 1]), sampled from
+        the given mip level, or None if there is no color image.
+        """
+        
+        if self.color is None:
+            return None
+        
+        if level > 0:
+            return self.mip(level).rgbs_at_locs(u, v)
+        
+        x, y = locs_to_pixels(u, v, self.colorSize)
+        return self.color[y, x]
     
-    def color_at_loc(self, loc):
-        if self.color == None:
+    def color_at_loc(self, loc, level=0):
+        """
+        Returns the color (tuple of 8-bit r, g, b) at the coordinates in
+        loc (range [0, 1]), or None if there is no color image
+        """
+        
+        if self.color is None:
             return None
+        elif level > 0:
+            return self.mip(level).color_at_loc(loc)
         else:
-            size = self.color.size
-            x = floor(loc[0] * size[0]) % size[0]
-            y = min(floor(loc[1] * size[1]), nextafter(size[1], -inf))
-            return self.color.getpixel((x,y))
+            x, y = locs_to_pixels(loc[0], loc[1], self.colorSize)
+            return tuple(int(c) for c in self.color[y, x])
              
 class StackedImageWrapper(ImageWrapper):
     """
@@ -150,7 +578,8 @@ class StackedImageWrapper(ImageWrapper):
     from standard 8-bit images).
     """
     
-    def __init__(self, imgPaths, weights, alphaPath=None, colorPath=None):
+    def __init__(self, imgPaths, weights, alphaPath=None, colorPath=None,
+                 rawWidth=None, rawHeight=None, rawDtype=None, reduce=1):
         """
         Opens and prepares images to be used for height map
         
@@ -166,118 +595,53 @@ class StackedImageWrapper(ImageWrapper):
                      half the image maximum at a point, it is a hole). If this
                      image has an alpha channel, it is ignored ("alpha" is
                      only sourced from image luma.)
+        rawWidth, rawHeight, rawDtype -- layout of any .raw heightmaps (see
+                                         load_heightmap)
+        reduce -- int factor to shrink all of the images by as they are
+                  decoded, as for ImageWrapper
         """
         
         if len(imgPaths) != len(weights):
             sys.exit("""Error: imgPaths and weights for StackedImageWrapper
                         are different lenghths""")
         
-        self.images = []
         self.weights = weights
         self.totalWeight = sum(weights)
+        depths = []
+        alphas = []
         
         for imgPath in imgPaths:
-            try:
-                img = Image.open(imgPath)
-            except:
-                print("Error: failed to open image at " + imgPath)
-            
-            if img.mode in IMAGE_MODES_TO_CONVERT:
-                img = img.convert('RGB')
-            elif img.mode in IMAGE_MODES_TO_CONVERT_ALPHA:
-                img = img.convert('RGBA')
-            
-            if img.mode in PIXEL_MAXES:
-                self.images.append(img)
-            else:
-                sys.exit("Error: image at " + imgPath
-                         + "is an unsupported mode, " + img.mode)
-        
-        self.alpha = None
+            depth, alpha = load_heightmap(imgPath, rawWidth, rawHeight,
+                                          rawDtype, reduce)
+            depths.append(depth)
+            alphas.append(alpha if alpha is not None else np.ones_like(depth))
+        
+        # fuse the stack into one weighted height plane and one weighted
+        # alpha plane on a common grid (large enough for the biggest image),
+        # so sampling costs the same no matter how many images are stacked
+        self.size = (max(depth.shape[1] for depth in depths),
+                     max(depth.shape[0] for depth in depths))
+        self.depth = np.zeros((self.size[1], self.size[0]), dtype=np.float32)
+        baseAlpha = np.zeros_like(self.depth)
+        self.mipLevels = []
+        
+        for depth, alpha, weight in zip(depths, alphas, weights):
+            weight = weight / self.totalWeight
+            self.depth += resample_nearest(depth, self.size) * weight
+            baseAlpha += resample_nearest(alpha, self.size) * weight
+        
+        alpha = None
         
         if alphaPath is not None:
             try:
-                self.alpha = Image.open(alphaPath)
+                alpha = Image.open(alphaPath)
             except:
                 print("Error: failed to open image at " + alphaPath)
             
-            self.alpha = self.alpha.convert('L')
-        
-        self.color = None
+            factor = draft_image(alpha, reduce)
+            alpha = alpha.convert('L').reduce(factor)
         
-        if colorPath is not None:
-            try:
-                self.color = Image.open(colorPath)
-            except:
-                print("Error: failed to open image at " + colorPath)
-            
-            self.color = self.color.convert('RGB')
-        
-    def depth_luma_at_pixel(self, loc, img):
-        """
-        Returns the luma value at the pixel coordinates in loc in
-        the image at index img in self.images.
-        """
-        
-        if self.images[img].mode == 'RGB' or self.images[img].mode == 'RGBA':
-            return rgb_to_luma(self.images[img].getpixel(loc)) \
-                   / PIXEL_MAXES[self.images[img].mode]
-        elif self.images[img].mode == 'LA':
-            return self.images[img].getpixel(loc)[0] \
-                   / PIXEL_MAXES[self.images[img].mode]
-        else: # L
-            return self.images[img].getpixel(loc) \
-                   / PIXEL_MAXES[self.images[img].mode]    
-    
-    def height_at_loc(self, loc):
-        """
-        Returns the height (luma value from the weighted sum of images) at
-        the coordinates in loc (range [0, 1])
-        """
-        
-        height = 0
-        
-        for i in range(len(self.images)):
-            size = self.images[i].size
-            x = floor(loc[0] * size[0]) % size[0]
-            y = min(floor(loc[1] * size[1]), nextafter(size[1], -inf))
-            height += self.depth_luma_at_pixel((x, y), i) * self.weights[i]
-        
-        return height / self.totalWeight
-    
-    def hole_at_loc(self, loc):
-        """
-        Returns whether there is a hole at the coordinates in loc
-        (range [0, 1]), determined by a weighted average of the the alpha
-        channels in self.images and the luma in alphaImg, if present (if
-        either is below 0.5 times its maximum value.)
-        """
-        
-        alphaImgAlpha = 1
-        baseImgsAlpha = 0
-        
-        if self.alpha is not None:
-            size = self.alpha.size
-            x = floor(loc[0] * size[0]) % size[0]
-            y = min(floor(loc[1] * size[1]), nextafter(size[1], -inf))
-            
-            alphaImgAlpha = self.alpha.getpixel((x,y)) \
-            / PIXEL_MAXES[self.alpha.mode] 
-        
-        for i in range(len(self.images)):
-            img = self.images[i]
-            
-            size = img.size
-            x = floor(loc[0] * size[0]) % size[0]
-            y = min(floor(loc[1] * size[1]), nextafter(size[1], -inf))
-            
-            if img.mode == 'LA':
-                baseImgsAlpha += img.getpixel((x,y))[1] * self.weights[i] \
-                / PIXEL_MAXES[img.mode]
-            elif img.mode == 'RGBA':
-                baseImgsAlpha += img.getpixel((x,y))[3] \
-                * self.weights[i] / PIXEL_MAXES[img.mode]
-            else:
-                baseImgsAlpha += self.weights[i]
+        # a hole wherever the weighted alpha of the stack is under half
+        self.build_hole_mask(baseAlpha, alpha)
         
-        return alphaImgAlpha < 0.5 or baseImgsAlpha / self.totalWeight < 0.5
+        self.load_color(colorPath, reduce)
@@ -0,0 +1,469 @@
+import os
+import sys
+import time
+import zlib
+import shutil
+import zipfile
+import tempfile
+import numpy as np
+from sstl_image import *
+from sstl_shapes import *
+from sstl_mesh import *
+from sstl_stl import *
+
+# file formats meshes can be written in (see open_mesh_file)
+MESH_FILE_FORMATS = ("stl", "ply", "obj", "3mf")
+
+# binary PLY vertex and face records
+PLY_VERTEX = np.dtype([("pt", "<f4", (3,))])
+PLY_COLOR_VERTEX = np.dtype([("pt", "<f4", (3,)), ("rgb", "u1", (3,))])
+PLY_FACE = np.dtype([("n", "u1"), ("ids", "<i4", (3,))])
+
+# fixed parts of the 3MF package (see ThreeMFFileWrapper)
+THREEMF_CONTENT_TYPES = (
+    '<?xml version="1.0" encoding="UTF-8"?>\n'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/'
+    'content-types">'
+    '<Default Extension="rels" ContentType="application/'
+    'vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="model" ContentType="application/'
+    'vnd.ms-package.3dmanufacturing-3dmodel+xml"/>'
+    '</Types>\n')
+THREEMF_RELS = (
+    '<?xml version="1.0" encoding="UTF-8"?>\n'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/'
+    'relationships">'
+    '<Relationship Target="/3D/3dmodel.model" Id="rel0" '
+    'Type="http://schemas.microsoft.com/3dmanufacturing/2013/01/3dmodel"/>'
+    '</Relationships>\n')
+THREEMF_MODEL_PATH = "3D/3dmodel.model"
+
+def format_lines(line, values):
+    """
+    Formats each row of the 2D array values with the % format string line
+    (all at once, which is much faster than a row at a time), returning
+    the ASCII encoded text.
+    """
+    
+    return ((line * len(values)) % tuple(values.ravel().tolist())) \
+           .encode("ascii")
+
+def open_stream(path):
+    """
+    Returns the binary file to write to for path, which may also be "-" for
+    standard output or an open binary file-like object (see
+    STLFileWrapper), and whether it is such a stream.
+    """
+    
+    if path == "-":
+        return sys.stdout.buffer, True
+    elif hasattr(path, "write"):
+        return path, True
+    else:
+        return open(path, "xb"), False
+
+class IndexedFileWrapper():
+    """
+    Base of the files that store a mesh as a list of vertices and a list of
+    triangles indexing into it (rather than repeating every vertex in each
+    triangle, as STL does), with a color for each vertex.
+    A mesh is written to it one band at a time (see indexed_band). Each
+    vertex is written only once: those in a band's first row of points are
+    the ones already written for the last row of the band before it.
+    Subclasses write the vertices and triangles passed to write_vertices
+    and write_tris.
+    """
+    
+    def __init__(self, colors):
+        """
+        Arguments:
+        colors -- bool whether the file has vertex colors
+        """
+        
+        self.colors = colors
+        self.vertexCount = 0
+        self.triCount = 0
+        self.lastRowIds = None
+    
+    def write_band(self, vertices, tris, rgbs, firstRow, lastRow):
+        """
+        Writes a band of the mesh (the tuple returned by indexed_band).
+        Bands must be written in order, as each shares its first row with
+        the last row of the one before it.
+        """
+        
+        used = np.zeros(len(vertices), dtype=bool)
+        used[tris] = True
+        ids = np.full(len(vertices), -1, dtype=np.int64)
+        
+        if self.lastRowIds is not None:
+            ids[firstRow] = self.lastRowIds
+        
+        new = used & (ids < 0)
+        newCount = int(np.count_nonzero(new))
+        ids[new] = self.vertexCount + np.arange(newCount)
+        
+        if self.colors and rgbs is None:
+            rgbs = np.zeros((len(vertices), 3), dtype=np.uint8)
+        
+        self.write_vertices(vertices[new],
+                            rgbs[new] if self.colors else None)
+        self.write_tris(ids[tris])
+        
+        self.vertexCount += newCount
+        self.triCount += len(tris)
+        self.lastRowIds = ids[lastRow]
+    
+    def end_mesh(self):
+        """
+        Ends the mesh being written, so that the next band written starts
+        a new one (of a different face) instead of continuing it
+        """
+        
+        self.lastRowIds = None
+
+class PLYFileWrapper(IndexedFileWrapper):
+    """
+    Binary PLY file of an indexed mesh. The counts of vertices and faces
+    come first in the header, so the faces are kept in a temporary file
+    until the file is closed (as are the vertices, for a stream).
+    """
+    
+    def __init__(self, path, colors):
+        """
+        create new file at the given path (or stream, see open_stream) and
+        write a header to be completed on close
+        """
+        
+        IndexedFileWrapper.__init__(self, colors)
+        
+        self.f, self.streamed = open_stream(path)
+        self.triFile = tempfile.TemporaryFile()
+        
+        if self.streamed:
+            self.vertexFile = tempfile.TemporaryFile()
+        else:
+            self.vertexFile = self.f
+            self.f.write(self.header())
+    
+    def header(self):
+        """
+        Returns the PLY header for the vertices and triangles written so far
+        (counts are zero padded, so it is always the same length)
+        """
+        
+        lines = ["ply", "format binary_little_endian 1.0",
+                 "comment Created by sphere-stl",
+                 "element vertex %010d" % self.vertexCount,
+                 "property float x", "property float y", "property float z"]
+        
+        if self.colors:
+            lines += ["property uchar red", "property uchar green",
+                      "property uchar blue"]
+        
+        lines += ["element face %010d" % self.triCount,
+                  "property list uchar int vertex_indices", "end_header"]
+        
+        return ("\n".join(lines) + "\n").encode("ascii")
+    
+    def write_vertices(self, vertices, rgbs):
+        """Writes vertices (V, 3) and their colors (V, 3 uint8, or None)"""
+        
+        records = np.empty(len(vertices),
+                           dtype=PLY_COLOR_VERTEX if self.colors
+                           else PLY_VERTEX)
+        records["pt"] = vertices
+        
+        if self.colors:
+            records["rgb"] = rgbs
+        
+        self.vertexFile.write(records.tobytes())
+    
+    def write_tris(self, tris):
+        """Writes triangles (T, 3 array of indices of written vertices)"""
+        
+        records = np.empty(len(tris), dtype=PLY_FACE)
+        records["n"] = 3
+        records["ids"] = tris
+        self.triFile.write(records.tobytes())
+    
+    def close(self):
+        """Completes the header, appends the faces and closes the file"""
+        
+        if self.streamed:
+            self.f.write(self.header())
+            self.vertexFile.seek(0)
+            shutil.copyfileobj(self.vertexFile, self.f)
+            self.vertexFile.close()
+        else:
+            self.f.seek(0)
+            self.f.write(self.header())
+            self.f.seek(0, os.SEEK_END)
+        
+        self.triFile.seek(0)
+        shutil.copyfileobj(self.triFile, self.f)
+        self.triFile.close()
+        
+        if self.streamed:
+            self.f.flush()
+        else:
+            self.f.close()
+
+class OBJFileWrapper(IndexedFileWrapper):
+    """
+    Wavefront OBJ file of an indexed mesh. OBJ has no header, so it is
+    written straight through; vertex colors are written as the (widely
+    supported) r g b values after each vertex's coordinates.
+    """
+    
+    def __init__(self, path, colors):
+        """create new file at the given path (or stream, see open_stream)"""
+        
+        IndexedFileWrapper.__init__(self, colors)
+        
+        self.f, self.streamed = open_stream(path)
+        self.f.write(b"# Created by sphere-stl\n")
+    
+    def write_vertices(self, vertices, rgbs):
+        """Writes vertices (V, 3) and their colors (V, 3 uint8, or None)"""
+        
+        if len(vertices) == 0:
+            return
+        
+        # 9 significant digits give back exactly the same 32-bit floats as
+        # in the binary formats
+        if self.colors:
+            values = np.concatenate((vertices.astype(np.float32),
+                                     rgbs / 255), axis=1)
+            line = "v %.9g %.9g %.9g %.4g %.4g %.4g\n"
+        else:
+            values = vertices.astype(np.float32)
+            line = "v %.9g %.9g %.9g\n"
+        
+        self.f.write(format_lines(line, values))
+    
+    def write_tris(self, tris):
+        """Writes triangles (T, 3 array of indices of written vertices)"""
+        
+        if len(tris) == 0:
+            return
+        
+        # OBJ indices start at 1
+        self.f.write(format_lines("f %d %d %d\n", tris + 1))
+    
+    def close(self):
+        """Closes the file (a stream is only flushed)"""
+        
+        if self.streamed:
+            self.f.flush()
+        else:
+            self.f.close()
+
+class CompressedSpool():
+    """
+    Temporary file that text written to is compressed into as it arrives,
+    so that it can be read back later while taking up little disk space.
+    """
+    
+    def __init__(self):
+        self.f = tempfile.TemporaryFile()
+        self.compressor = zlib.compressobj(1)
+        self.size = 0
+    
+    def write(self, data):
+        """Compresses data (bytes) into the file"""
+        
+        self.size += len(data)
+        self.f.write(self.compressor.compress(data))
+    
+    def chunks(self, chunkSize=1 << 20):
+        """
+        Yields the uncompressed contents back a chunk at a time, then
+        closes the file (so this can only be done once, after the last
+        write)
+        """
+        
+        self.f.write(self.compressor.flush())
+        self.f.seek(0)
+        decompressor = zlib.decompressobj()
+        
+        for data in iter(lambda: self.f.read(chunkSize), b''):
+            yield decompressor.decompress(data)
+        
+        yield decompressor.flush()
+        self.f.close()
+
+class ThreeMFFileWrapper(IndexedFileWrapper):
+    """
+    3MF file (a zip package with an XML model) of an indexed mesh, with
+    vertex colors in a color group. The model needs the colors, vertices
+    and triangles each as one run, but bands give a few of each at a time,
+    so each run is compressed into a CompressedSpool as it arrives. On
+    close, the model is streamed from the spools through the zip file's
+    own compression, so it is never on disk uncompressed.
+    """
+    
+    def __init__(self, path, colors):
+        """create new file at the given path (or stream, see open_stream)"""
+        
+        IndexedFileWrapper.__init__(self, colors)
+        
+        self.f, self.streamed = open_stream(path)
+        
+        # a spool is only read back (and closed) when it is written to
+        self.colorSpool = CompressedSpool() if self.colors else None
+        self.vertexSpool = CompressedSpool()
+        self.triSpool = CompressedSpool()
+    
+    def write_vertices(self, vertices, rgbs):
+        """Writes vertices (V, 3) and their colors (V, 3 uint8, or None)"""
+        
+        if len(vertices) == 0:
+            return
+        
+        # 9 significant digits give back exactly the same 32-bit floats as
+        # in the binary formats
+        self.vertexSpool.write(format_lines(
+            '<vertex x="%.9g" y="%.9g" z="%.9g"/>\n',
+            vertices.astype(np.float32)))
+        
+        if self.colors:
+            self.colorSpool.write(format_lines(
+                '<m:color color="#%02X%02X%02X"/>\n', rgbs))
+    
+    def write_tris(self, tris):
+        """Writes triangles (T, 3 array of indices of written vertices)"""
+        
+        if len(tris) == 0:
+            return
+        
+        # each vertex's color has the same index in the color group as
+        # the vertex has in the vertices
+        if self.colors:
+            self.triSpool.write(format_lines(
+                '<triangle v1="%d" v2="%d" v3="%d" p1="%d" p2="%d" p3="%d"/>'
+                '\n', np.concatenate((tris, tris), axis=1)))
+        else:
+            self.triSpool.write(format_lines(
+                '<triangle v1="%d" v2="%d" v3="%d"/>\n', tris))
+    
+    def model_parts(self):
+        """Yields the text of the model (bytes) in order, a part at a time"""
+        
+        yield ('<?xml version="1.0" encoding="UTF-8"?>\n'
+               '<model unit="millimeter" xml:lang="en-US" '
+               'xmlns="http://schemas.microsoft.com/3dmanufacturing/core/'
+               '2015/02" xmlns:m="http://schemas.microsoft.com/'
+               '3dmanufacturing/material/2015/02">\n'
+               '<metadata name="Application">sphere-stl</metadata>\n'
+               '<resources>\n').encode("ascii")
+        
+        if self.colors:
+            yield b'<m:colorgroup id="1">\n'
+            yield from self.colorSpool.chunks()
+            yield b'</m:colorgroup>\n<object id="2" type="model" pid="1" ' \
+                  b'pindex="0">\n'
+        else:
+            yield b'<object id="2" type="model">\n'
+        
+        yield b'<mesh>\n<vertices>\n'
+        yield from self.vertexSpool.chunks()
+        yield b'</vertices>\n<triangles>\n'
+        yield from self.triSpool.chunks()
+        yield (b'</triangles>\n</mesh>\n</object>\n</resources>\n'
+               b'<build>\n<item objectid="2"/>\n</build>\n</model>\n')
+    
+    def close(self):
+        """Writes the package and closes the file (a stream is flushed)"""
+        
+        package = zipfile.ZipFile(self.f, "w", zipfile.ZIP_DEFLATED)
+        package.writestr("[Content_Types].xml", THREEMF_CONTENT_TYPES)
+        package.writestr("_rels/.rels", THREEMF_RELS)
+        
+        # the model's size is roughly known up front, which lets the zip
+        # file use 64-bit sizes for it only when it needs them
+        info = zipfile.ZipInfo(THREEMF_MODEL_PATH,
+                               time.localtime(time.time())[:6])
+        info.compress_type = zipfile.ZIP_DEFLATED
+        info.file_size = self.vertexSpool.size + self.triSpool.size
+        
+        if self.colors:
+            info.file_size += self.colorSpool.size
+        
+        with package.open(info, "w") as model:
+            for part in self.model_parts():
+                model.write(part)
+        
+        package.close()
+        
+        if self.streamed:
+            self.f.flush()
+        else:
+            self.f.close()
+
+def open_mesh_file(path, fileFormat, colorMode, count=None):
+    """
+    Opens a new mesh file of the given format.
+    
+    Arguments:
+    path -- path of the file, or "-" or a binary file-like object to stream
+            it to
+    fileFormat -- one of MESH_FILE_FORMATS
+    colorMode -- STL color mode; any other format has vertex colors unless
+                 it is None
+    count -- number of triangles that will be written, which an STL stream
+             needs up front (see STLFileWrapper)
+    
+    Return -- an STLFileWrapper, PLYFileWrapper, OBJFileWrapper or
+              ThreeMFFileWrapper
+    """
+    
+    if fileFormat == "stl":
+        return STLFileWrapper(path, colorMode, count)
+    elif fileFormat == "ply":
+        return PLYFileWrapper(path, colorMode is not None)
+    elif fileFormat == "obj":
+        return OBJFileWrapper(path, colorMode is not None)
+    elif fileFormat == "3mf":
+        return ThreeMFFileWrapper(path, colorMode is not None)
+    else:
+        sys.exit("Error: outputFormat was not one of "
+                 + ", ".join(MESH_FILE_FORMATS))
+
+def write_indexed_mesh(solid, out, face=None, bandRows=BAND_ROWS, pool=None):
+    """
+    Writes the mesh of face (if solid is a Sphere) or of the solid itself
+    (if Prism) to an indexed mesh file, one band of rows at a time.
+    
+    Arguments:
+    solid -- The Sphere or Prism containing the height map
+    out -- The PLYFileWrapper, OBJFileWrapper or ThreeMFFileWrapper to
+           write to
+    face -- The TriFace or QuadFace, for a Sphere
+    bandRows -- int number of rows of mesh triangles to build at a time, or
+                None to build the whole mesh at once
+    pool -- BandPool (see sstl_parallel) to build the bands in, or None to
+            build them here
+    """
+    
+    if pool is not None:
+        bands = pool.indexed_bands(out.colors, face, bandRows)
+    else:
+        bands = (indexed_band(solid, face, rows, out.colors)
+                 for rows in band_ranges(solid, face, bandRows))
+    
+    for band in bands:
+        out.write_band(*band)
+    
+    out.end_mesh()
+
+def write_mesh_file(solid, out, face=None, pool=None):
+    """
+    Writes the mesh of face (if solid is a Sphere) or of the solid itself
+    (if Prism) to out, a file opened by open_mesh_file, whatever its format
+    """
+    
+    if isinstance(out, STLFileWrapper):
+        write_mesh_tris(solid, out, face, pool=pool)
+    else:
+        write_indexed_mesh(solid, out, face, pool=pool)
@@ -1,10 +1,15 @@
 import os
 import sys
 import json
+import argparse
 from sstl_math import *
 from sstl_image import *
 from sstl_shapes import *
 from sstl_stl import *
+from sstl_tiles import *
+from sstl_cache import *
+from sstl_indexed import *
+from sstl_parallel import *
 
 def get_param(params, key):
     if key in params:
@@ -12,7 +17,96 @@ def get_param(params, key):
     else:
         sys.exit("parameter " + str(key) + " missing from params.json")
 
-def create_stls():
+def get_optional_param(params, key, default):
+    """Like get_param, but for parameters that older params.json files lack"""
+    
+    if key in params:
+        return params[key]
+    else:
+        return default
+
+def get_resolution(params, key, adaptive):
+    """
+    Like get_param, for a mesh resolution, which is rounded up to a power of
+    2 if adaptive (see adaptive_triangulation)
+    """
+    
+    res = get_param(params, key)
+    return next_power_of_two(res) if adaptive else res
+
+def load_image_wrapper(params):
+    """
+    Opens the images named in params, returning an ImageWrapper or
+    interface-equivalent object. Decoded planes are taken from (and stored
+    to) the image cache if it is enabled.
+    """
+    
+    tiledParams = get_optional_param(params, "tiledImageParams", None)
+    cacheParams = get_optional_param(params, "imageCache", None)
+    rawParams = get_optional_param(params, "rawImageParams",
+        {"width": None, "height": None, "dtype": None})
+    rawLayout = (get_param(rawParams, "width"), get_param(rawParams, "height"),
+        get_param(rawParams, "dtype"))
+    reduce = get_optional_param(params, "imageReduce", 1)
+    
+    if (tiledParams is not None) and get_param(tiledParams, "enabled"):
+        if (len(get_param(params, "depthImages")) > 1):
+            sys.exit("tiled heightmaps cannot be stacked (depthImages must" + \
+                     " have a single image)")
+        
+        # tiled heightmaps are never decoded as a whole, so are not cached
+        return TiledImageWrapper(get_param(params, "depthImages")[0],
+            get_param(params, "holeImage"), get_param(params, "colorImage"),
+            get_param(tiledParams, "tileSize"),
+            get_param(tiledParams, "tileCacheSize"), *rawLayout)
+    
+    cache = None
+    
+    if (cacheParams is not None) and get_param(cacheParams, "enabled"):
+        cache = DecodedImageCache(
+            os.path.expanduser(get_param(cacheParams, "path")),
+            get_param(cacheParams, "maxSize"))
+        key = cache.key(get_param(params, "depthImages")
+            + [get_param(params, "holeImage"),
+               get_param(params, "colorImage")],
+            (get_param(params, "depthImageWeights"), rawLayout, reduce))
+        planes = cache.load(key)
+        
+        if planes is not None:
+            return ImageWrapper.from_planes(planes)
+    
+    if (len(get_param(params, "depthImages")) > 1):
+        img = StackedImageWrapper(get_param(params, "depthImages"),
+            get_param(params, "depthImageWeights"),
+            get_param(params, "holeImage"),
+            get_param(params, "colorImage"), *rawLayout, reduce)
+    else:
+        img = ImageWrapper(get_param(params, "depthImages")[0],
+            get_param(params, "holeImage"), get_param(params, "colorImage"),
+            *rawLayout, reduce)
+    
+    if cache is not None:
+        cache.store(key, img.planes())
+    
+    return img
+
+def create_stls(jobs=None, toStdout=False):
+    """
+    Creates the STL files described by params.json.
+    
+    Arguments:
+    jobs -- int number of worker processes to build meshes with, which
+            overrides the "workers" parameter if given
+    toStdout -- bool whether to stream the solid to standard output as an
+                STL file, instead of writing files to the output path (a
+                sphere must then have a single face)
+    """
+    
+    # the STL file takes over standard output, so messages go to stderr
+    if toStdout:
+        out = sys.stdout.buffer
+        sys.stdout = sys.stderr
+    
     try:
         paramsFile = open("params.json", 'r')
     except:
@@ -28,15 +122,28 @@ def create_stls():
             != len(get_param(params, "depthImageWeights"))):
        sys.exit("depthImages and depthImageWeights are different lengths")
 
-    if (len(get_param(params, "depthImages")) > 1):
-        img = StackedImageWrapper(get_param(params, "depthImages"),
-            get_param(params, "depthImageWeights"),
-            get_param(params, "holeImage"),
-            get_param(params, "colorImage"))
-       
-    else:
-        img = ImageWrapper(get_param(params, "depthImages")[0],
-            get_param(params, "holeImage"), get_param(params, "colorImage"))
+    img = load_image_wrapper(params)
+    mipmaps = get_optional_param(params, "mipmaps", False)
+    collapseBottoms = get_optional_param(params, "collapseFlatBottoms", False)
+    decimation = get_optional_param(params, "decimation", None)
+    maxError = None
+    
+    if (decimation is not None) and get_param(decimation, "enabled"):
+        maxError = get_param(decimation, "maxError")
+        
+        if not maxError > 0:
+            sys.exit("decimation maxError must be greater than 0")
+    
+    adaptiveParams = get_optional_param(params, "adaptiveSubdivision", None)
+    adaptiveError = None
+    
+    if (adaptiveParams is not None) and get_param(adaptiveParams, "enabled"):
+        adaptiveError = get_param(adaptiveParams, "maxError")
+        
+        if not adaptiveError > 0:
+            sys.exit("adaptiveSubdivision maxError must be greater than 0")
+    
+    adaptive = adaptiveError is not None
 
     if params["solid"] == "sphere":
         solidParams = get_param(params, "sphereParams")
@@ -66,14 +173,14 @@ def create_stls():
             for quad in faces["quads"]:
                 assembledFaces.append( \
                     QuadFace([faces["pts"][i] for i in quad],
-                    get_param(solidParams, "resolution1"),
-                    get_param(solidParams, "resolution2"),
+                    get_resolution(solidParams, "resolution1", adaptive),
+                    get_resolution(solidParams, "resolution2", adaptive),
                     get_param(solidParams, "flatBottomFaces"),
                     get_param(solidParams, "flatTopFaces")))
                 
             for tri in faces["tris"]:
                 assembledFaces.append(TriFace([faces["pts"][i] for i in tri],
-                    get_param(solidParams, "resolution1"),
+                    get_resolution(solidParams, "resolution1", adaptive),
                     get_param(solidParams, "flatBottomFaces"),
                     get_param(solidParams, "flatTopFaces")))
         except:
@@ -106,52 +213,114 @@ def create_stls():
             get_param(solidParams, "minAltitude"),
             get_param(solidParams, "maxAltitude"),
             get_param(solidParams, "lowCutoff"), rotation,
-            get_param(solidParams, "scale"))
+            get_param(solidParams, "scale"), mipmaps, collapseBottoms,
+            maxError, adaptiveError)
         
     elif params["solid"] == "prism":
         solidParams = get_param(params, "prismParams")
         solid = Prism(img, get_param(solidParams, "width"),
-            get_params(solidParams, "height"),
-            get_param(solidParams, "resolutionX"),
-            get_param(solidParams, "resolutionY"),
+            get_param(solidParams, "height"),
+            get_resolution(solidParams, "resolutionX", adaptive),
+            get_resolution(solidParams, "resolutionY", adaptive),
             get_param(solidParams, "minAltitude"),
-            get_param(solidParams, "maxAltitude"))
+            get_param(solidParams, "maxAltitude"), mipmaps,
+            collapseBottoms, maxError, adaptiveError)
        
     else:
         sys.exit("solid was not a valid value (either 'sphere' or 'prism')")
 
-    try:
-       os.mkdir(path)
-    except FileExistsError:
-       if not os.path.isdir(path):
-           sys.exit("Specified output path was a file, not a path")
-    except FileNotFoundError:
-       sys.exit("Could not create output path" + \
-                " (parent directory does not exist)")
-    except:
-       sys.exit("Could not create output path")
+    if toStdout:
+        if isinstance(solid, Sphere) and len(solid.faces) != 1:
+            sys.exit("Error: only a prism or a sphere with a single face can"
+                     + " be written to standard output")
+    else:
+        try:
+           os.mkdir(path)
+        except FileExistsError:
+           if not os.path.isdir(path):
+               sys.exit("Specified output path was a file, not a path")
+        except FileNotFoundError:
+           sys.exit("Could not create output path" + \
+                    " (parent directory does not exist)")
+        except:
+           sys.exit("Could not create output path")
 
     colorMode = get_param(params, "colorMode")
 
     if get_param(params, "colorImage") == None:
         colorMode = None
-
-    if isinstance(solid, Sphere):
-        for faceNum in range(len(solid.faces)):
-            face = solid.faces[faceNum]
-            print("writing sphere face " + str(faceNum))
-           
-            stl = STLFileWrapper(os.path.join(path, name + "_" + \
-                str(faceNum) + ".stl"), colorMode)
-            write_mesh_tris(solid, stl, face)
-            
-            stl.close()
-            faceNum += 1
+    
+    fileFormat = get_optional_param(params, "outputFormat", "stl")
+    
+    if fileFormat not in MESH_FILE_FORMATS:
+        sys.exit("outputFormat was not one of 'stl', 'ply', 'obj' or '3mf'")
+    
+    extension = "." + fileFormat
+    workers = jobs
+    
+    if workers is None:
+        workers = get_optional_param(params, "workers", 1)
+    
+    if not workers:
+        workers = os.cpu_count() or 1
+    
+    # with at least as many faces as workers, each worker writes whole
+    # faces; otherwise all of the workers build each face (or the prism)
+    # together, in bands of rows
+    if not toStdout and isinstance(solid, Sphere) \
+            and 1 < workers <= len(solid.faces):
+        write_faces_parallel(solid,
+            [os.path.join(path, name + "_" + str(faceNum) + extension)
+             for faceNum in range(len(solid.faces))], fileFormat, colorMode,
+            workers)
+        return
+    
+    pool = None
+    
+    if workers > 1:
+        pool = BandPool(solid, workers)
+    
+    try:
+        if toStdout:
+            face = solid.faces[0] if isinstance(solid, Sphere) else None
             
-    elif isinstance(solid, Prism):
-        stl = STLFileWrapper(os.path.join(path, name + ".stl"))
-        write_mesh_tris(solid, stl)
-        stl.close()
+            if fileFormat == "stl":
+                stream_mesh_tris(solid, out, colorMode, face, pool)
+            else:
+                meshFile = open_mesh_file(out, fileFormat, colorMode)
+                write_mesh_file(solid, meshFile, face, pool)
+                meshFile.close()
+        
+        elif isinstance(solid, Sphere):
+            for faceNum in range(len(solid.faces)):
+                face = solid.faces[faceNum]
+                print("writing sphere face " + str(faceNum))
+                
+                meshFile = open_mesh_file(os.path.join(path, name + "_" + \
+                    str(faceNum) + extension), fileFormat, colorMode)
+                write_mesh_file(solid, meshFile, face, pool)
+                
+                meshFile.close()
+                faceNum += 1
+        
+        elif isinstance(solid, Prism):
+            meshFile = open_mesh_file(os.path.join(path, name + extension),
+                                      fileFormat, colorMode)
+            write_mesh_file(solid, meshFile, pool=pool)
+            meshFile.close()
+    finally:
+        if pool is not None:
+            pool.close()
 
 if __name__ == "__main__":
-    create_stls()
+    parser = argparse.ArgumentParser(
+        description="Creates STL files as described by params.json")
+    parser.add_argument("-j", "--jobs", type=int, default=None,
+        help="number of worker processes to build meshes with (0 for one"
+             + " per CPU), overriding \"workers\" in params.json")
+    parser.add_argument("--stdout", action="store_true",
+        help="write the mesh file to standard output (for piping to another"
+             + " program) instead of to outputPath; spheres must have a"
+             + " single face")
+    args = parser.parse_args()
+    create_stls(args.jobs, args.stdout)
@@ -26,6 +26,26 @@ def normalize(vec):
     mag = length(vec)
     return vec if mag == 0 else np.array([val/mag for val in vec])
 
+def lengths(vecs):
+    """
+    Returns the lengths of an array of vectors (float arraylike with a last
+    axis of length 3, such as shape (N, 3)), with the shape of vecs minus
+    its last axis
+    """
+    
+    vecs = np.asarray(vecs, dtype=np.float64)
+    return np.sqrt(np.sum(vecs * vecs, axis=-1))
+
+def normalize_all(vecs):
+    """
+    Normalizes an array of vectors (float arraylike with a last axis of
+    length 3, such as shape (N, 3)), leaving 0 length vectors unchanged
+    """
+    
+    vecs = np.asarray(vecs, dtype=np.float64)
+    mags = lengths(vecs)[..., np.newaxis]
+    return vecs / np.where(mags == 0, 1, mags)
+
 def cartesian_to_spherical(pt):
     """
     Transforms pt, a length 3 arraylike in cartesian coordinates, to
@@ -68,6 +88,34 @@ def cartesian_to_cylindrical_map(pt):
     latitude = sin(-atan2(pt[2], sqrt(pt[0]**2 + pt[1]**2)))
     return (longitude / (2 * pi) + 0.5, latitude / 2 + 0.5)
 
+def cartesian_to_equirectangular_maps(pts):
+    """
+    Array version of cartesian_to_equirectangular_map: transforms pts, a
+    float arraylike of cartesian points with a last axis of length 3 (such
+    as shape (N, 3), or a single point), to an array of image coordinates
+    with a last axis of length 2
+    """
+    
+    pts = np.asarray(pts, dtype=np.float64)
+    longitude = np.arctan2(pts[..., 1], pts[..., 0])
+    latitude = -np.arctan2(pts[..., 2],
+                           np.sqrt(pts[..., 0]**2 + pts[..., 1]**2))
+    return np.stack((longitude / (2 * pi) + 0.5, latitude / pi + 0.5), -1)
+
+def cartesian_to_cylindrical_maps(pts):
+    """
+    Array version of cartesian_to_cylindrical_map: transforms pts, a float
+    arraylike of cartesian points with a last axis of length 3 (such as
+    shape (N, 3), or a single point), to an array of image coordinates with
+    a last axis of length 2
+    """
+    
+    pts = np.asarray(pts, dtype=np.float64)
+    longitude = np.arctan2(pts[..., 1], pts[..., 0])
+    latitude = np.sin(-np.arctan2(pts[..., 2],
+                                  np.sqrt(pts[..., 0]**2 + pts[..., 1]**2)))
+    return np.stack((longitude / (2 * pi) + 0.5, latitude / 2 + 0.5), -1)
+
 def rotate(pt, rotation):
     """
     Applies rotation matrix to pt and returns the result.
@@ -79,5 +127,30 @@ def rotate(pt, rotation):
     
     return np.transpose(np.matmul(rotation, np.transpose(pt)))
 
-projections = {"equirectangular": cartesian_to_equirectangular_map,
-               "cylindrical": cartesian_to_cylindrical_map}
+def rotate_all(pts, rotation):
+    """
+    Applies rotation matrix to each point of pts and returns the results.
+    
+    Arguments:
+    pts-- float arraylike of points with a last axis of length 3 (such as
+          shape (N, 3))
+    rotation-- 3x3 array, rotation matrix
+    """
+    
+    return np.matmul(np.asarray(pts, dtype=np.float64),
+                     np.transpose(rotation))
+
+def is_power_of_two(n):
+    """Returns whether int n is a power of 2 (1 included)"""
+    
+    return n > 0 and (n & (n - 1)) == 0
+
+def next_power_of_two(n):
+    """Returns the smallest power of 2 that is at least int n"""
+    
+    return 1 << max(0, int(n) - 1).bit_length()
+
+# the array versions of the projections, which also take single points, so
+# that whole grids of points can be projected in one call
+projections = {"equirectangular": cartesian_to_equirectangular_maps,
+               "cylindrical": cartesian_to_cylindrical_maps}
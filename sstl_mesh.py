@@ -0,0 +1,1152 @@
+from sstl_math import *
+from sstl_shapes import *
+from sstl_decimate import *
+from sstl_adaptive import *
+
+# one triangle exactly as it is laid out in a binary STL file
+STL_RECORD = np.dtype([("normal", "<f4", (3,)), ("v0", "<f4", (3,)),
+                       ("v1", "<f4", (3,)), ("v2", "<f4", (3,)),
+                       ("attr", "<u2")])
+
+def triangle_normals(tris):
+    """
+    Returns the unit normals of an array of triangles (float arraylike of
+    shape (T, 3, 3), vertices counterclockwise as per the STL format) as a
+    (T, 3) array, with 0 normals for triangles with no area (as for
+    MeshTri)
+    """
+    
+    tris = np.asarray(tris, dtype=np.float64)
+    return normalize_all(np.cross(tris[:, 1] - tris[:, 0],
+                                  tris[:, 2] - tris[:, 0]))
+
+class TriangleBuffer():
+    """
+    Growable buffer of triangles, stored as an array of binary STL records
+    (STL_RECORD) so that they can be written out without any conversion.
+    Meshes are appended a whole chunk of triangles at a time, with their
+    normals computed in bulk.
+    """
+    
+    def __init__(self, capacity=4096):
+        """
+        Arguments:
+        capacity -- int number of triangles to make room for up front (the
+                    buffer grows as needed)
+        """
+        
+        self.data = np.empty(capacity, dtype=STL_RECORD)
+        self.count = 0
+    
+    def __len__(self):
+        return self.count
+    
+    @property
+    def records(self):
+        """The STL_RECORD array of the triangles in the buffer"""
+        
+        return self.data[:self.count]
+    
+    def clear(self):
+        """Empties the buffer (keeping its memory for reuse)"""
+        
+        self.count = 0
+    
+    def append(self, tris, colors=None):
+        """
+        Appends triangles to the buffer.
+        
+        Arguments:
+        tris -- float arraylike of shape (T, 3, 3), the vertices of each
+                triangle (counterclockwise as per the STL format)
+        colors -- arraylike of T packed STL color attribute words, or None
+                  for no color
+        """
+        
+        tris = np.asarray(tris, dtype=np.float64).reshape(-1, 3, 3)
+        end = self.count + len(tris)
+        
+        if end > len(self.data):
+            data = np.empty(max(end, len(self.data) * 2), dtype=STL_RECORD)
+            data[:self.count] = self.records
+            self.data = data
+        
+        chunk = self.data[self.count:end]
+        chunk["normal"] = triangle_normals(tris)
+        chunk["v0"] = tris[:, 0]
+        chunk["v1"] = tris[:, 1]
+        chunk["v2"] = tris[:, 2]
+        chunk["attr"] = 0 if colors is None else colors
+        self.count = end
+    
+    def append_mesh(self, vertices, tris, colors=None):
+        """
+        Appends the triangles of an indexed mesh (as built by
+        mesh_sphere_face or mesh_prism) to the buffer.
+        
+        Arguments:
+        vertices -- (V, 3) float array of vertices
+        tris -- (T, 3) int array of the vertex indices of each triangle
+        colors -- arraylike of T packed STL color attribute words, or None
+        """
+        
+        self.append(vertices[tris], colors)
+
+def face_transform(solid, face):
+    """
+    Returns the (R, origin) transform that lays a face of a Sphere flat: a
+    point p (already scaled by solid.scale) is placed at R @ (p - origin),
+    which puts the face's first corner (on the lowCutoff surface) at the
+    origin, its first side along x and its normal along z.
+    """
+    
+    if solid.normalizeFaceVertices:
+        corners = [normalize(pt) for pt in face.pts]
+    else:
+        corners = face.pts
+    
+    scaledCorners = [np.multiply(pt, solid.scale) for pt in corners]
+    
+    R = Rotation.align_vectors([x_axis, z_axis],
+        [scaledCorners[1] - scaledCorners[0],
+         np.cross(scaledCorners[1] - scaledCorners[0],
+                  scaledCorners[2] - scaledCorners[0])])[0].as_matrix()
+    
+    return R, scaledCorners[0] * solid.lowCutoff
+
+def lattice_rows(solid, face=None):
+    """
+    Returns the number of rows of mesh points of face (if solid is a Sphere)
+    or of solid itself (if Prism)
+    """
+    
+    if isinstance(solid, Prism):
+        return solid.resolutionY + 1
+    elif isinstance(face, TriFace):
+        return face.resolution + 1
+    else:
+        return face.resolution1 + 1
+
+def tri_face_lattice(face, corners, rows=None):
+    """
+    Builds the grid of mesh points of a TriFace and how they connect.
+    Row i of the grid (0 to face.resolution) runs from corners[0] + i steps
+    along the side to corners[1], to the same along the side to corners[2],
+    and has i + 1 points; point j of row i is at index i * (i + 1) / 2 + j.
+    
+    Arguments:
+    face -- the TriFace
+    corners -- float arraylike, the 3 (possibly normalized) corner points
+    rows -- range of consecutive rows to build only that band of the grid
+            (indexed from its first row), or None for the whole grid
+    
+    Return -- (pts, tris, borders) tuple: the (N, 3) array of points, the
+              (M, 3) int array of the indices of each top surface triangle
+              (counterclockwise seen from outside the sphere), and a list of
+              (indices, flip, alongRow) tuples for the walls along the
+              sides of the face (see lattice_mesh)
+    """
+    
+    res = face.resolution
+    corners = [np.asarray(pt, dtype=np.float64) for pt in corners]
+    rows = np.arange(res + 1) if rows is None else np.asarray(rows)
+    rowStarts = rows * (rows + 1) // 2 - rows[0] * (rows[0] + 1) // 2
+    
+    i = np.repeat(rows, rows + 1)
+    j = np.arange(len(i)) - np.repeat(rowStarts, rows + 1)
+    c1 = (i / res)[:, np.newaxis]
+    c2 = (j / np.maximum(i, 1))[:, np.newaxis]
+    d1 = ((corners[1] - corners[0]) * c1) + corners[0]
+    d2 = ((corners[2] - corners[0]) * c1) + corners[0]
+    pts = ((d2 - d1) * c2) + d1
+    
+    # triangles between row i - 1 and row i: i pointing towards corners[0]
+    # and i - 1 pointing away from it
+    # (there are as many triangles pointing towards corners[0] before
+    # those of row r as there are points before row r - 1)
+    r = np.repeat(np.arange(1, len(rows)), rows[1:])
+    k = np.arange(len(r)) - rowStarts[r - 1]
+    prev = rowStarts[r - 1] + k
+    cur = rowStarts[r] + k
+    towards = np.stack((prev, cur, cur + 1), axis=-1)
+    away = np.stack((cur, prev, prev - 1), axis=-1)[k > 0]
+    
+    borders = [(rowStarts, False, False), (rowStarts + rows, True, False)]
+    
+    if rows[-1] == res:
+        borders.append((rowStarts[-1] + np.arange(res + 1), False, True))
+    
+    return pts, np.concatenate((towards, away)), borders
+
+def quad_face_lattice(face, corners, rows=None):
+    """
+    Builds the grid of mesh points of a QuadFace and how they connect. The
+    grid has face.resolution1 + 1 rows (from corners[0] towards corners[1])
+    of face.resolution2 + 1 points (from the start of the row towards
+    corners[2]); point j of row i is at index i * (resolution2 + 1) + j.
+    
+    Arguments:
+    face -- the QuadFace
+    corners -- float arraylike, the 3 (possibly normalized) corner points
+    rows -- range of consecutive rows to build only that band of the grid
+            (indexed from its first row), or None for the whole grid
+    
+    Return -- (pts, tris, borders) tuple, as for tri_face_lattice
+    """
+    
+    res1 = face.resolution1
+    res2 = face.resolution2
+    corners = [np.asarray(pt, dtype=np.float64) for pt in corners]
+    rows = np.arange(res1 + 1) if rows is None else np.asarray(rows)
+    
+    c1 = (rows / res1)[:, np.newaxis]
+    c2 = (np.arange(res2 + 1) / res2)[:, np.newaxis]
+    d1 = (corners[1] - corners[0]) * c1
+    d2 = (corners[2] - corners[0]) * c2
+    pts = (d1[:, np.newaxis] + d2[np.newaxis]) + corners[0]
+    
+    return (pts.reshape(-1, 3),) + grid_lattice(len(rows), res2 + 1,
+                                                rows[0] == 0,
+                                                rows[-1] == res1)
+
+def grid_lattice(rows, cols, top=True, bottom=True):
+    """
+    Returns the (tris, borders) connecting a rectangular grid of points with
+    the given number of rows and columns (point j of row i at index
+    i * cols + j), as for tri_face_lattice. Each cell of the grid is split
+    into two triangles along its diagonal from (i + 1, j) to (i, j + 1).
+    top and bottom are whether the first and last rows are borders (they
+    are not when the grid is a band in the middle of a bigger one).
+    """
+    
+    ids = np.arange(rows * cols).reshape(rows, cols)
+    prev = ids[:-1, :-1].ravel()
+    cur = ids[1:, :-1].ravel()
+    tris = np.concatenate((np.stack((prev, cur, prev + 1), axis=-1),
+                           np.stack((prev + 1, cur, cur + 1), axis=-1)))
+    
+    borders = [(ids[:, 0], False, False), (ids[:, -1], True, False)]
+    
+    if top:
+        borders.append((ids[0], True, True))
+    
+    if bottom:
+        borders.append((ids[-1], False, True))
+    
+    return tris, borders
+
+def sphere_missing(solid, face, pts, heights, holes):
+    """
+    Returns which top vertices of a Sphere face are missing: holes, and
+    those at or below the bottom surface.
+    
+    Arguments:
+    solid -- the Sphere
+    face -- the TriFace or QuadFace the points belong to
+    pts -- (N, 3) float array of mesh points on the face
+    heights -- (N,) float array of the heights sampled at pts
+    holes -- (N,) bool array of the holes sampled at pts
+    """
+    
+    if face.flatBottom:
+        ptLengths = lengths(pts)
+        baseHeights = ptLengths * solid.lowCutoff
+        
+        if face.flatTop:
+            return (heights * ptLengths <= baseHeights) | holes
+        else:
+            return (heights <= baseHeights) | holes
+    else:
+        return (heights <= solid.lowCutoff) | holes
+
+def sphere_lattice_vertices(solid, face, pts, level=0):
+    """
+    Places the top and bottom vertices of a Sphere face over its grid of
+    mesh points, sampling the height map at all of them at once.
+    
+    Arguments:
+    solid -- the Sphere
+    face -- the TriFace or QuadFace the points belong to
+    pts -- (N, 3) float array of mesh points on the face
+    level -- int mip level of the images to sample (default 0)
+    
+    Return -- (tops, bases, missing, samplePts) tuple: the (N, 3) arrays of
+              top and bottom vertices (laid flat by face_transform), the
+              bool array of which top vertices are missing (holes, or below
+              the bottom surface), and the (N, 3) array of the points to
+              sample colors at (the bottom vertices before being laid flat)
+    """
+    
+    heights = solid.heights_at_pts(pts, level)
+    missing = sphere_missing(solid, face, pts, heights,
+                             solid.holes_at_pts(pts, level))
+    heights = heights[:, np.newaxis]
+    
+    if face.flatBottom:
+        bases = pts * solid.lowCutoff
+        
+        if face.flatTop:
+            tops = pts * heights
+        else:
+            tops = normalize_all(pts) * heights
+    else:
+        pts = normalize_all(pts)
+        bases = pts * solid.lowCutoff
+        tops = pts * heights
+    
+    R, origin = face_transform(solid, face)
+    samplePts = bases
+    tops = rotate_all(tops * solid.scale - origin, R)
+    bases = rotate_all(bases * solid.scale - origin, R)
+    
+    return tops, bases, missing, samplePts
+
+def wall_fans(tops, bases, missing, indices):
+    """
+    Finds the walls along a run of border points that can be merged when
+    the bottom surface is collapsed (see collapse_flat_bottom). All of the
+    walls along a side of a face lie in one plane (through the side and
+    the center of the sphere, or upright for a Prism), and their bottom
+    edges in one line, so neighboring walls between present points are
+    all one polygon: the top vertices, which the top surface needs, over a
+    straight bottom edge, which only needs its ends. Such a run of walls
+    is made a fan around its first bottom vertex, of one triangle under
+    each top edge and one closing it off, instead of two triangles under
+    each top edge.
+    Fans are grown one after another from the start of the run, each for
+    as long as all of its triangles face the way the walls do (so that
+    none of them overlap).
+    
+    Arguments:
+    tops, bases -- (N, 3) float arrays of the top and bottom vertices
+    missing -- (N,) bool array, whether each top vertex is missing
+    indices -- int array of the indices of the run of border points
+    
+    Return -- (starts, ends) tuple of int arrays of the positions in
+              indices of the first and last points of each fan (all of
+              which span at least two walls)
+    """
+    
+    t = tops[indices]
+    b = bases[indices]
+    present = ~missing[indices]
+    starts = []
+    ends = []
+    start = 0
+    
+    while start < len(indices) - 2:
+        if not present[start]:
+            start += 1
+            continue
+        
+        # look ahead at twice as many points each time the fan fills them
+        size = 8
+        
+        while True:
+            stop = min(start + size, len(indices) - 1)
+            ahead = slice(start + 1, stop + 1)
+            behind = slice(start, stop)
+            normals = np.cross(b[start] - t[behind], t[ahead] - t[behind])
+            facing = (normals @ normals[0]) > 0
+            grown = np.logical_and.accumulate(present[ahead] & facing)
+            
+            if grown.all() and stop < len(indices) - 1:
+                size *= 2
+            else:
+                break
+        
+        closing = np.cross(b[start] - t[ahead], b[ahead] - t[ahead])
+        fits = np.flatnonzero(grown & ((closing @ normals[0]) > 0))
+        
+        if len(fits) > 0 and fits[-1] >= 1:
+            starts.append(start)
+            ends.append(start + 1 + fits[-1])
+            start = ends[-1]
+        else:
+            start += 1
+    
+    return np.array(starts, dtype=np.int64), np.array(ends, dtype=np.int64)
+
+def fan_walls(starts, ends):
+    """
+    Returns the (positions, firsts) int arrays of the walls merged into the
+    fans from wall_fans: the position of the first point of each merged
+    wall in the row, and of the first point of its fan
+    """
+    
+    lengths = ends - starts
+    firsts = np.repeat(starts, lengths)
+    offsets = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths)
+                                                   - lengths, lengths)
+    
+    return firsts + offsets, firsts
+
+def grid_turns(rows, cols, p, q, r):
+    """
+    Returns which way the triangles (p, q, r) of points of a grid turn, as
+    int arrays (or ints) of twice their signed areas in (row, column)
+    coordinates: positive for those wound as top surface triangles are,
+    negative for those wound the other way and 0 for those with no area.
+    Every grid (see tri_face_lattice and quad_face_lattice) is an affine
+    image of its (row, column) coordinates, so this holds for the points
+    themselves too.
+    
+    Arguments:
+    rows, cols -- (N,) int arrays of the row and column of each point
+    p, q, r -- int arrays (or ints) of point indices
+    """
+    
+    return (rows[q] - rows[p]) * (cols[r] - cols[p]) \
+           - (cols[q] - cols[p]) * (rows[r] - rows[p])
+
+def zip_rows(upper, lower, cols):
+    """
+    Triangulates the area between two rows of points that has nothing in
+    it (no holes, and no points of the rows in between), as a strip walked
+    along both rows from their first points to their last.
+    
+    Arguments:
+    upper, lower -- int arrays of the indices of the points of each row, in
+                    order along it (upper being the row before lower)
+    cols -- (N,) int array of the column of each point
+    
+    Return -- (T, 3) int array of the point indices of each triangle, wound
+              as top surface triangles
+    """
+    
+    order = np.argsort(np.concatenate((cols[upper[1:]], cols[lower[1:]])),
+                       kind="stable")
+    alongUpper = order < len(upper) - 1
+    i = np.cumsum(alongUpper) - alongUpper
+    j = np.cumsum(~alongUpper) - ~alongUpper
+    third = np.where(alongUpper, upper[np.minimum(i + 1, len(upper) - 1)],
+                     lower[np.minimum(j + 1, len(lower) - 1)])
+    
+    return np.stack((upper[i], lower[j], third), axis=-1)
+
+def side_triangles(first, chain, last, rows, cols, sign):
+    """
+    Triangulates the part of a collapsed bottom surface (see
+    collapse_flat_bottom) along a side of the grid whose points between
+    first and last are all dropped: the polygon between the straight side
+    from first to last and the chain of the first corners of the rows in
+    between (or their last corners, on the side the rows end at). The
+    chain has a point in each row, so the polygon is monotone along the
+    side, and is cut into triangles in one pass along it, from first to
+    last, keeping a stack of the chain points not yet cut off.
+    
+    Arguments:
+    first, last -- int indices of the points at the ends of the side
+    chain -- list of the int indices of the chain points, in order of row
+    rows, cols -- (N,) int arrays of the row and column of each point
+    sign -- 1 if the side is the one the rows start at, -1 if the other
+    
+    Return -- list of (p, q, r) tuples of the point indices of each
+              triangle, wound as top surface triangles
+    """
+    
+    tris = []
+    stack = [first]
+    
+    if len(chain) == 0:
+        return tris
+    
+    for point in chain + [last]:
+        # cut off the chain points that stick out towards the side
+        while len(stack) >= 2 and sign * grid_turns(rows, cols, stack[-2],
+                                                    point, stack[-1]) > 0:
+            if sign > 0:
+                tris.append((stack[-2], point, stack[-1]))
+            else:
+                tris.append((stack[-2], stack[-1], point))
+            
+            stack.pop()
+        
+        stack.append(point)
+    
+    # last can see all of the chain points left (if any); those on a line
+    # through it are fanned around the point before them instead
+    stack.pop()
+    
+    if len(stack) < 2:
+        return tris
+    
+    apex = len(stack) - 1
+    
+    while apex > 1 and grid_turns(rows, cols, stack[apex - 1], stack[-1],
+                                  last) == 0:
+        apex -= 1
+    
+    fans = [(last, stack[k], stack[k + 1]) for k in range(apex - 1)]
+    fans += [(stack[apex - 1], stack[k], stack[k + 1])
+             for k in range(apex, len(stack) - 1)]
+    fans.append((stack[apex - 1], stack[-1], last))
+    
+    for p, q, r in fans:
+        if grid_turns(rows, cols, p, q, r) > 0:
+            tris.append((p, q, r))
+        else:
+            tris.append((p, r, q))
+    
+    return tris
+
+def collapse_flat_bottom(tris, missing, borders, dropped=None):
+    """
+    Triangulates a flat bottom surface with as few triangles as the rest of
+    the mesh allows, in place of the one bottom triangle under each top
+    surface triangle. The corners it must keep are the border points (the
+    walls end on them, apart from those inside merged walls, see
+    wall_fans) and the missing points (top surface triangles use their
+    bottom vertices); every other point is dropped, and its triangles
+    merged into long ones.
+    Between two neighboring rows that both have corners, the triangles
+    form a strip, which is walked from the start of the rows to their end.
+    Moving each point back along its row to the last corner at or before
+    it (or on to the first, before that) turns the strip into one over
+    the corners alone: triangles that then have two of the same corner
+    have no area and are left out, and the rest cover the same surface.
+    Edges between two corners (as between neighboring missing points) are
+    kept, so the bottom still meets the top surface and walls at every
+    edge. Rows with no corners at all (whose sides are inside merged walls,
+    and which have no missing points) are bridged by a single strip
+    between the rows with corners before and after them. Where the walls
+    along a side are merged, what is left between the side and the first
+    (or last) corners of the rows is triangulated on its own (see
+    side_triangles).
+    
+    Arguments:
+    tris -- (M, 3) int array of the vertex indices of each bottom triangle
+            (laid out as top surface triangles, see lattice_mesh)
+    missing -- (N,) bool array, whether each top vertex is missing
+    borders -- list of (indices, flip, alongRow) tuples of the runs of
+               border points (see lattice_mesh), which must include the
+               first and last points of every row
+    dropped -- (N,) bool array of the border points whose bottom vertices
+               no wall uses (those inside wall fans), or None
+    
+    Return -- (T, 3) int array of the vertex indices of each triangle of the
+              collapsed bottom surface, laid out as tris
+    """
+    
+    corners = missing.copy()
+    sides = []
+    
+    for indices, flip, alongRow in borders:
+        corners[indices] = True
+        
+        if not alongRow:
+            sides.append(indices)
+    
+    if dropped is not None:
+        corners &= ~dropped
+    
+    # the points of each row are numbered consecutively along it
+    firsts = np.minimum(sides[0], sides[1])
+    lasts = np.maximum(sides[0], sides[1])
+    rows = np.repeat(np.arange(len(firsts)), lasts - firsts + 1)
+    cols = np.arange(len(corners)) - firsts[rows]
+    cornerIds = np.flatnonzero(corners)
+    rowCorners = np.bincount(rows[cornerIds], minlength=len(firsts))
+    firstCorners = cornerIds[np.minimum(np.searchsorted(cornerIds, firsts),
+                                        len(cornerIds) - 1)]
+    lastCorners = cornerIds[np.searchsorted(cornerIds, lasts, "right") - 1]
+    
+    lastCorner = np.maximum.accumulate(np.where(corners,
+                                                np.arange(len(corners)), -1))
+    lastCorner = np.where(lastCorner >= firsts[rows], lastCorner,
+                          firstCorners[rows])
+    strips = tris[rowCorners[rows[tris].min(axis=1)] > 0]
+    strips = strips[rowCorners[rows[strips].max(axis=1)] > 0]
+    strips = lastCorner[strips]
+    chunks = [strips[(strips[:, 0] != strips[:, 1])
+                     & (strips[:, 1] != strips[:, 2])
+                     & (strips[:, 2] != strips[:, 0])]]
+    
+    cornerRows = np.flatnonzero(rowCorners)
+    cornerStarts = np.cumsum(rowCorners) - rowCorners
+    
+    for upper, lower in zip(cornerRows[:-1], cornerRows[1:]):
+        if lower > upper + 1:
+            chunks.append(zip_rows(
+                cornerIds[cornerStarts[upper]:cornerStarts[upper]
+                          + rowCorners[upper]],
+                cornerIds[cornerStarts[lower]:cornerStarts[lower]
+                          + rowCorners[lower]], cols))
+    
+    for side, chain, sign in ((firsts, firstCorners, 1),
+                              (lasts, lastCorners, -1)):
+        inside = np.flatnonzero(~corners[side])
+        
+        # each run of rows whose side points are dropped
+        for run in np.split(inside, np.flatnonzero(np.diff(inside) > 1)
+                            + 1):
+            if len(run) > 0:
+                sideTris = side_triangles(side[run[0] - 1],
+                                          [int(chain[r]) for r in run
+                                           if rowCorners[r] > 0],
+                                          side[run[-1] + 1], rows, cols,
+                                          sign)
+                chunks.append(np.array(sideTris, dtype=np.int64)
+                              .reshape(-1, 3))
+    
+    return np.concatenate(chunks)
+
+def border_fans(tops, bases, missing, borders, merge):
+    """
+    Finds the wall fans (see wall_fans) of each of borders (see
+    lattice_mesh).
+    
+    Arguments:
+    tops, bases -- (N, 3) float arrays of the top and bottom vertices (only
+                   those of the border points are used)
+    missing -- (N,) bool array, whether each top vertex is missing
+    borders -- list of (indices, flip, alongRow) tuples
+    merge -- bool whether to merge walls at all (if not, there are no fans)
+    
+    Return -- (fans, dropped) tuple: a list of the (starts, ends) fans of
+              each border, and the (N,) bool array of the points whose
+              bottom vertices are inside fans (see collapse_flat_bottom)
+    """
+    
+    noFans = (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64))
+    fans = []
+    dropped = np.zeros(len(missing), dtype=bool)
+    
+    for indices, flip, alongRow in borders:
+        if merge:
+            starts, ends = wall_fans(tops, bases, missing, indices)
+            positions, firsts = fan_walls(starts, ends)
+            dropped[indices[positions[positions > firsts]]] = True
+            fans.append((starts, ends))
+        else:
+            fans.append(noFans)
+    
+    return fans, dropped
+
+def lattice_mesh(tops, bases, missing, samplePts, tris, borders, degenerate,
+                 collapse=False, maxError=None):
+    """
+    Connects a grid of top and bottom vertices into a closed mesh: the top
+    surface, the bottom surface, and the walls along the borders of the
+    grid. A top surface triangle with missing vertices uses the bottom
+    vertices in their place, and is left out if all three are missing. A
+    wall stands between each two neighboring border points, and ends at a
+    missing one. When the bottom surface is collapsed, the walls are merged
+    into fans where they can be (see wall_fans). When
+    the top surface is decimated (see decimate_mesh), the border points
+    and bottom vertices stay where they are, so the walls and bottom
+    surface still meet it edge for edge.
+    
+    Arguments:
+    tops, bases -- (N, 3) float arrays of the top and bottom vertices
+    missing -- (N,) bool array, whether each top vertex is missing
+    samplePts -- (N, D) float array of the point to sample color at for
+                 each vertex (the color of a triangle is sampled at the
+                 center of its vertices' points)
+    tris -- (M, 3) int array of the vertex indices of each triangle of the
+            top surface, counterclockwise seen from above
+    borders -- list of (indices, flip, alongRow) tuples, each an int array
+               of the indices of a run of border points, whether its walls
+               face the other way (to keep them pointing out of the mesh)
+               and whether the run lies along a row of points
+    degenerate -- bool whether the bottom vertices are all one point (no
+                  bottom surface is made, and walls are single triangles)
+    collapse -- bool whether to merge the triangles of a flat bottom
+                surface into as few as possible (see collapse_flat_bottom),
+                and the walls with it
+    maxError -- float largest height error (along z) decimating the top
+                surface may add, or None to keep every triangle
+    
+    Return -- (vertices, tris, colorPts) tuple: the (2N, 3) array of all
+              vertices (tops, then bases), the (T, 3) int array of the
+              vertex indices of each triangle, and the (T, D) array of
+              points to sample each triangle's color at
+    """
+    
+    n = len(tops)
+    topIds = np.where(missing, np.arange(n) + n, np.arange(n))
+    missingCount = missing[tris].sum(axis=1)
+    kept = tris[missingCount < 3]
+    keptCenters = (samplePts[kept[:, 0]] + samplePts[kept[:, 1]]
+                   + samplePts[kept[:, 2]]) / 3
+    fans, dropped = border_fans(tops, bases, missing, borders,
+                                collapse and not degenerate)
+    
+    if degenerate:
+        onTop = missingCount[missingCount < 3] <= 1
+        triChunks = [topIds[kept[onTop]]]
+        colorChunks = [keptCenters[onTop]]
+    elif collapse:
+        bottoms = collapse_flat_bottom(kept, missing, borders, dropped)
+        triChunks = [topIds[kept], bottoms[:, [0, 2, 1]] + n]
+        colorChunks = [keptCenters,
+                       (samplePts[bottoms[:, 0]] + samplePts[bottoms[:, 1]]
+                        + samplePts[bottoms[:, 2]]) / 3]
+    else:
+        triChunks = [topIds[kept], kept[:, [0, 2, 1]] + n]
+        colorChunks = [keptCenters, keptCenters]
+    
+    for (indices, flip, alongRow), (starts, ends) in zip(borders, fans):
+        single = np.ones(len(indices) - 1, dtype=bool)
+        positions, firsts = fan_walls(starts, ends)
+        single[positions] = False
+        t1 = indices[:-1][single]
+        t2 = indices[1:][single]
+        m1 = missing[t1]
+        m2 = missing[t2]
+        
+        # the wall between each pair of neighboring border points is the
+        # triangles (t1, b1, t2) and (t2, b1, b2), or whichever one of them
+        # remains when a top point is missing
+        both = ~m1 & ~m2
+        walls = [np.stack((t1, t1 + n, t2), axis=-1)[both]]
+        
+        if degenerate:
+            wallColors = [samplePts[t1[both]]]
+        else:
+            walls.append(np.stack((t2, t1 + n, t2 + n), axis=-1)[~m2])
+            walls.append(np.stack((t1, t1 + n, t2 + n), axis=-1)[~m1 & m2])
+            wallColors = [samplePts[t2[both]], samplePts[t2[~m2]],
+                          samplePts[t1[~m1 & m2]]]
+        
+        # a fan's walls are (t1, b, t2) around the bottom vertex b of its
+        # first point, closed off by (t, b, bt) at its last point
+        walls.append(np.stack((indices[positions], indices[firsts] + n,
+                               indices[positions + 1]), axis=-1))
+        walls.append(np.stack((indices[ends], indices[starts] + n,
+                               indices[ends] + n), axis=-1))
+        wallColors += [samplePts[indices[positions]],
+                       samplePts[indices[ends]]]
+        walls = np.concatenate(walls)
+        
+        if flip:
+            walls = walls[:, [0, 2, 1]]
+        
+        triChunks.append(walls)
+        colorChunks.extend(wallColors)
+    
+    vertices = np.concatenate((tops, bases))
+    
+    # the top surface comes first; only the top vertices of points inside
+    # the borders can be removed from it
+    if maxError is not None:
+        locked = np.arange(2 * n) >= n
+        
+        for indices, flip, alongRow in borders:
+            locked[indices] = True
+        
+        triChunks[0] = decimate_mesh(vertices, triChunks[0], locked,
+                                     maxError,
+                                     np.concatenate(triChunks[1:]))
+        topPts = np.concatenate((samplePts, samplePts))[triChunks[0]]
+        colorChunks[0] = (topPts[:, 0] + topPts[:, 1] + topPts[:, 2]) / 3
+    
+    return vertices, np.concatenate(triChunks), np.concatenate(colorChunks)
+
+def lattice_triangle_count(missing, tris, borders, degenerate,
+                           collapse=False, tops=None, bases=None):
+    """
+    Returns the number of triangles lattice_mesh makes from the same
+    arguments (see lattice_mesh), without making them. tops and bases are
+    only needed (to find the wall fans) if collapse is set.
+    """
+    
+    missingCount = missing[tris].sum(axis=1)
+    fans, dropped = border_fans(tops, bases, missing, borders,
+                                collapse and not degenerate)
+    
+    if degenerate:
+        count = np.count_nonzero(missingCount <= 1)
+    elif collapse:
+        count = np.count_nonzero(missingCount < 3) \
+                + len(collapse_flat_bottom(tris[missingCount < 3], missing,
+                                           borders, dropped))
+    else:
+        count = 2 * np.count_nonzero(missingCount < 3)
+    
+    for (indices, flip, alongRow), (starts, ends) in zip(borders, fans):
+        single = np.ones(len(indices) - 1, dtype=bool)
+        single[fan_walls(starts, ends)[0]] = False
+        m1 = missing[indices[:-1][single]]
+        m2 = missing[indices[1:][single]]
+        count += np.count_nonzero(~m1 & ~m2) + np.sum(ends - starts + 1)
+        
+        if not degenerate:
+            count += np.count_nonzero(~m2) + np.count_nonzero(~m1 & m2)
+    
+    return int(count)
+
+def face_lattice(solid, face, rows=None):
+    """
+    Returns the (pts, tris, borders) lattice of the mesh points of one face
+    of a Sphere, or of a band of its rows (see tri_face_lattice).
+    """
+    
+    if solid.normalizeFaceVertices:
+        corners = [normalize(pt) for pt in face.pts]
+    else:
+        corners = face.pts
+    
+    if isinstance(face, TriFace):
+        return tri_face_lattice(face, corners, rows)
+    else:
+        return quad_face_lattice(face, corners, rows)
+
+def prism_lattice(solid, rows=None):
+    """
+    Returns the lattice of the mesh points of a Prism, or of a band of its
+    rows.
+    
+    Return -- (uvs, tris, borders) tuple: the (N, 2) float array of the
+              points' height map coordinates (range [0, 1]), and the
+              triangles and borders as from grid_lattice
+    """
+    
+    cols = solid.resolutionX + 1
+    rows = np.arange(solid.resolutionY + 1) if rows is None \
+           else np.asarray(rows)
+    
+    x = np.tile(np.arange(cols) / solid.resolutionX, len(rows))
+    y = np.repeat(rows / solid.resolutionY, cols)
+    tris, borders = grid_lattice(len(rows), cols, rows[0] == 0,
+                                 rows[-1] == solid.resolutionY)
+    
+    return np.stack((x, y), axis=-1), tris, borders
+
+def prism_lattice_vertices(solid, uvs, level=0):
+    """
+    Places the top and bottom vertices of a Prism over its grid of mesh
+    points, sampling the height map at all of them at once.
+    
+    Arguments:
+    solid -- the Prism
+    uvs -- (N, 2) float array of the points' height map coordinates
+    level -- int mip level of the images to sample (default 0)
+    
+    Return -- (tops, bases, missing) tuple, as for sphere_lattice_vertices
+    """
+    
+    heights = solid.heights_at_pts(uvs, level)
+    missing = ~(heights > 0) | solid.holes_at_pts(uvs, level)
+    bases = np.stack((uvs[:, 0] * solid.w, -uvs[:, 1] * solid.h,
+                      np.zeros(len(uvs))), axis=-1)
+    tops = bases.copy()
+    tops[:, 2] = heights
+    
+    return tops, bases, missing
+
+def adaptive_lattice_tris(solid, face, tops, missing, borders):
+    """
+    Returns the top surface triangles of face (if solid is a Sphere) or of
+    solid itself (if Prism) subdivided adaptively (see
+    adaptive_triangulation), in place of those of the uniform grid. Every
+    border point is kept, so the walls are unchanged.
+    
+    Arguments:
+    solid -- the Sphere or Prism
+    face -- the TriFace or QuadFace, for a Sphere
+    tops -- (N, 3) float array of the top vertices of the whole grid
+    missing -- (N,) bool array, whether each top vertex is missing
+    borders -- list of (indices, flip, alongRow) tuples (see lattice_mesh)
+    
+    Return -- (M, 3) int array of the vertex indices of each triangle, as
+              from tri_face_lattice
+    """
+    
+    if isinstance(face, TriFace):
+        res = face.resolution
+        i, j = np.meshgrid(np.arange(res + 1), np.arange(res + 1),
+                           indexing="ij")
+        
+        # only the points with j <= i are on the face
+        ids = np.where(j <= i, i * (i + 1) // 2 + j, 0)
+        roots = triangle_roots(res)
+    else:
+        rows = lattice_rows(solid, face)
+        cols = lattice_row_length(solid, face, 0)
+        ids = np.arange(rows * cols).reshape(rows, cols)
+        roots = square_roots(rows, cols)
+    
+    locked = np.zeros(len(missing), dtype=bool)
+    
+    for indices, flip, alongRow in borders:
+        locked[indices] = True
+    
+    return adaptive_triangulation(roots, ids, tops, missing, locked,
+                                  solid.adaptiveError)
+
+def meshed_whole(solid):
+    """
+    Returns whether each face of solid (if a Sphere) or solid itself (if a
+    Prism) is only built as a whole, rather than in bands of rows: when it
+    is decimated (see decimate_mesh) or subdivided adaptively (see
+    adaptive_lattice_tris), which need all of its points at once
+    """
+    
+    return solid.maxError is not None or solid.adaptiveError is not None
+
+def collapses_bottom(solid, face=None):
+    """
+    Returns whether the bottom surface of face (if solid is a Sphere) or of
+    solid itself (if Prism) is collapsed into as few triangles as possible
+    (see collapse_flat_bottom): only when the solid asks for it and the
+    bottom is flat (as a Prism's always is). An adaptively subdivided top
+    surface is not laid out in rows, so its bottom is never collapsed.
+    """
+    
+    if solid.adaptiveError is not None:
+        return False
+    elif isinstance(solid, Prism):
+        return solid.collapseBottoms
+    else:
+        return solid.collapseBottoms and face.flatBottom
+
+def mesh_geometry(solid, face=None, rows=None):
+    """
+    Builds the vertices and triangles of face (if solid is a Sphere) or of
+    solid itself (if Prism), or of a band of its rows, entirely with array
+    operations.
+    
+    Arguments:
+    solid -- the Sphere or Prism
+    face -- the TriFace or QuadFace, for a Sphere
+    rows -- range of consecutive rows of mesh points (see lattice_rows) to
+            build only the band of the mesh between them, or None for all
+            of it
+    
+    Return -- (vertices, tris, colorPts, vertexPts, level) tuple: vertices
+              and tris as from lattice_mesh, the points to sample the color
+              of each triangle and of each vertex at, and the mip level to
+              sample them from
+    """
+    
+    if isinstance(solid, Prism):
+        level = solid.lod_for_face()
+        samplePts, tris, borders = prism_lattice(solid, rows)
+        tops, bases, missing = prism_lattice_vertices(solid, samplePts,
+                                                      level)
+        degenerate = False
+    else:
+        level = solid.lod_for_face(face)
+        pts, tris, borders = face_lattice(solid, face, rows)
+        tops, bases, missing, samplePts = sphere_lattice_vertices(solid,
+            face, pts, level)
+        degenerate = solid.lowCutoff == 0
+    
+    if solid.adaptiveError is not None:
+        tris = adaptive_lattice_tris(solid, face, tops, missing, borders)
+    
+    vertices, tris, colorPts = lattice_mesh(tops, bases, missing, samplePts,
+        tris, borders, degenerate, collapses_bottom(solid, face),
+        solid.maxError)
+    
+    return vertices, tris, colorPts, \
+           np.concatenate((samplePts, samplePts)), level
+
+def mesh_sphere_face(solid, face, colorMode, rows=None):
+    """
+    Builds the mesh of one face of a Sphere entirely with array operations.
+    
+    Arguments:
+    solid -- the Sphere
+    face -- the TriFace or QuadFace to build the mesh of
+    colorMode -- STL color mode ('RGB' or 'BGR') to pack colors for, or
+                 None
+    rows -- range of consecutive rows of mesh points (see lattice_rows) to
+            build only the band of the mesh between them, or None for the
+            whole face
+    
+    Return -- (vertices, tris, colors) tuple: the (V, 3) float array of
+              vertices, the (T, 3) int array of the vertex indices of each
+              triangle (counterclockwise, as per the STL format), and the
+              uint16 array of T STL color attribute words
+    """
+    
+    vertices, tris, colorPts, vertexPts, level = mesh_geometry(solid, face,
+                                                               rows)
+    
+    return vertices, tris, solid.colors_at_pts(colorPts, colorMode, level)
+
+def mesh_prism(solid, colorMode, rows=None):
+    """
+    Builds the mesh of a Prism entirely with array operations: the top
+    surface over a regular grid of height map samples, the flat underside
+    (at a height of 0) and the walls around the perimeter.
+    
+    Arguments:
+    solid -- the Prism
+    colorMode -- STL color mode ('RGB' or 'BGR') to pack colors for, or
+                 None
+    rows -- range of consecutive rows of mesh points to build only the
+            band of the mesh between them, or None for the whole prism
+    
+    Return -- (vertices, tris, colors) tuple, as for mesh_sphere_face
+    """
+    
+    vertices, tris, colorPts, vertexPts, level = mesh_geometry(solid, None,
+                                                               rows)
+    
+    return vertices, tris, solid.colors_at_pts(colorPts, colorMode, level)
+
+def band_ranges(solid, face=None, bandRows=None):
+    """
+    Divides the mesh of face (if solid is a Sphere) or of solid itself (if
+    Prism) into bands of rows.
+    
+    Arguments:
+    solid -- the Sphere or Prism
+    face -- the TriFace or QuadFace, for a Sphere
+    bandRows -- int number of rows of mesh triangles in each band, or None
+                for a single band
+    
+    Return -- list of the ranges of point rows of each band (see
+              mesh_band), in order. Neighboring bands share their boundary
+              row of points. A mesh that is only built whole (see
+              meshed_whole) is always a single band.
+    """
+    
+    rowCount = lattice_rows(solid, face)
+    
+    if bandRows is None or meshed_whole(solid):
+        bandRows = rowCount - 1
+    else:
+        bandRows = max(1, bandRows)
+    
+    return [range(start, min(start + bandRows, rowCount - 1) + 1)
+            for start in range(0, rowCount - 1, bandRows)]
+
+def mesh_band(solid, colorMode, face, rows):
+    """
+    Builds the mesh of one band of rows of face (if solid is a Sphere) or
+    of solid itself (if Prism).
+    
+    Arguments:
+    solid -- the Sphere or Prism
+    colorMode -- STL color mode ('RGB' or 'BGR') to pack colors for, or
+                 None
+    face -- the TriFace or QuadFace, for a Sphere
+    rows -- range of the rows of points in the band (as from band_ranges)
+    
+    Return -- (vertices, tris, colors) tuple, as for mesh_sphere_face
+    """
+    
+    if isinstance(solid, Prism):
+        return mesh_prism(solid, colorMode, rows)
+    else:
+        return mesh_sphere_face(solid, face, colorMode, rows)
+
+def band_triangle_count(solid, face, rows):
+    """
+    Returns the exact number of triangles mesh_band makes for the same
+    band, sampling only the heights and holes (which decide the missing
+    vertices) rather than building any of the mesh. A mesh that is only
+    built whole (see meshed_whole) is only known once it has been
+    simplified or subdivided, so is built in full.
+    """
+    
+    if meshed_whole(solid):
+        return len(mesh_geometry(solid, face, rows)[1])
+    
+    collapse = collapses_bottom(solid, face)
+    tops = bases = None
+    
+    if isinstance(solid, Prism):
+        level = solid.lod_for_face()
+        uvs, tris, borders = prism_lattice(solid, rows)
+        tops, bases, missing = prism_lattice_vertices(solid, uvs, level)
+        degenerate = False
+    else:
+        level = solid.lod_for_face(face)
+        pts, tris, borders = face_lattice(solid, face, rows)
+        degenerate = solid.lowCutoff == 0
+        
+        # merging walls (see wall_fans) needs the vertices themselves
+        if collapse and not degenerate:
+            tops, bases, missing = sphere_lattice_vertices(solid, face, pts,
+                                                           level)[:3]
+        else:
+            missing = sphere_missing(solid, face, pts,
+                                     solid.heights_at_pts(pts, level),
+                                     solid.holes_at_pts(pts, level))
+    
+    return lattice_triangle_count(missing, tris, borders, degenerate,
+                                  collapse, tops, bases)
+
+def lattice_row_length(solid, face, row):
+    """
+    Returns the number of mesh points in row `row` of face (if solid is a
+    Sphere) or of solid itself (if Prism)
+    """
+    
+    if isinstance(solid, Prism):
+        return solid.resolutionX + 1
+    elif isinstance(face, TriFace):
+        return row + 1
+    else:
+        return face.resolution2 + 1
+
+def indexed_band(solid, face, rows, colors=False):
+    """
+    Builds one band of rows of face (if solid is a Sphere) or of solid
+    itself (if Prism) for an indexed mesh file, which stores each vertex
+    once and colors vertices rather than triangles.
+    
+    Arguments:
+    solid -- the Sphere or Prism
+    face -- the TriFace or QuadFace, for a Sphere
+    rows -- range of the rows of points in the band (as from band_ranges)
+    colors -- bool whether to sample the color of each vertex
+    
+    Return -- (vertices, tris, rgbs, firstRow, lastRow) tuple: vertices and
+              tris as for mesh_sphere_face (not every vertex is used), the
+              (V, 3) uint8 array of vertex colors (or None), and the int
+              arrays of the indices of the vertices over the first and last
+              rows of points (which the neighboring bands also have, in
+              the same order)
+    """
+    
+    vertices, tris, colorPts, vertexPts, level = mesh_geometry(solid, face,
+                                                               rows)
+    n = len(vertices) // 2
+    rgbs = None
+    
+    # tops and bases share their points, so colors are sampled only once
+    if colors:
+        rgbs = solid.rgbs_at_pts(vertexPts[:n], level)
+        
+        if rgbs is not None:
+            rgbs = np.concatenate((rgbs, rgbs))
+    
+    first = np.arange(lattice_row_length(solid, face, rows[0]))
+    last = np.arange(n - lattice_row_length(solid, face, rows[-1]), n)
+    lastBases = last + n
+    
+    # with a bottom radius of 0, the bottom vertices are all the center of
+    # the sphere, which is then stored once (as the first one)
+    if isinstance(solid, Sphere) and solid.lowCutoff == 0:
+        tris = np.where(tris >= n, n, tris)
+        lastBases = np.full(len(last), n)
+    
+    return vertices, tris, rgbs, np.concatenate((first, first + n)), \
+           np.concatenate((last, lastBases))
+
+def mesh_bands(solid, colorMode, face=None, bandRows=None):
+    """
+    Builds the mesh of face (if solid is a Sphere) or of solid itself (if
+    Prism) one band of rows at a time, so that only one band is held in
+    memory at once. Neighboring bands share their boundary row of points.
+    
+    Arguments:
+    solid -- the Sphere or Prism
+    colorMode -- STL color mode ('RGB' or 'BGR') to pack colors for, or
+                 None
+    face -- the TriFace or QuadFace to build the mesh of, for a Sphere
+    bandRows -- int number of rows of mesh triangles in each band, or None
+                for a single band
+    
+    Yield -- (vertices, tris, colors) tuple for each band, as for
+             mesh_sphere_face
+    """
+    
+    for rows in band_ranges(solid, face, bandRows):
+        yield mesh_band(solid, colorMode, face, rows)
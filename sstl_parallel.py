@@ -0,0 +1,428 @@
+import os
+import sys
+import copy
+import collections
+import multiprocessing
+from multiprocessing import shared_memory
+import numpy as np
+from sstl_image import *
+from sstl_shapes import *
+from sstl_stl import *
+from sstl_tiles import *
+from sstl_indexed import *
+
+# state of each worker process, set up once by init_worker
+workerSolid = None
+workerBlocks = []
+
+class WorkerExit(Exception):
+    """
+    Raised in place of SystemExit (from sys.exit) in a worker process. A
+    worker that exits would leave the pool waiting on it forever, so the
+    error is handed back to the main process to exit with instead.
+    """
+    
+    pass
+
+class SharedPlanes():
+    """
+    Copies of decoded image planes (see ImageWrapper.planes) in shared
+    memory, so that worker processes can map the planes decoded by the
+    main process instead of each decoding the images again.
+    """
+    
+    def __init__(self, planes):
+        """
+        Arguments:
+        planes -- dict of arrays, as returned by ImageWrapper.planes
+        """
+        
+        self.blocks = []
+        self.layout = {}
+        
+        try:
+            for name, plane in planes.items():
+                plane = np.ascontiguousarray(plane)
+                block = shared_memory.SharedMemory(create=True,
+                                                   size=max(1, plane.nbytes))
+                self.blocks.append(block)
+                np.ndarray(plane.shape, plane.dtype, buffer=block.buf)[...] = \
+                    plane
+                self.layout[name] = (block.name, plane.shape, plane.dtype.str)
+        except:
+            self.close()
+            raise
+    
+    def close(self):
+        """Frees the shared memory (once no worker needs it any more)"""
+        
+        for block in self.blocks:
+            block.close()
+            block.unlink()
+        
+        self.blocks = []
+
+def attach_planes(layout):
+    """
+    Maps planes shared by a SharedPlanes object in this process.
+    
+    Arguments:
+    layout -- the layout attribute of the SharedPlanes
+    
+    Return -- (planes, blocks), where planes is a dict of arrays backed by
+              the shared memory blocks in blocks, which must be kept open
+              for as long as the planes are used
+    """
+    
+    planes = {}
+    blocks = []
+    
+    for name, (blockName, shape, dtype) in layout.items():
+        block = shared_memory.SharedMemory(name=blockName)
+        blocks.append(block)
+        planes[name] = np.ndarray(shape, dtype, buffer=block.buf)
+    
+    return planes, blocks
+
+def init_worker(solid, layout):
+    """
+    Sets up a worker process to build meshes of solid.
+    
+    Arguments:
+    solid -- The Sphere or Prism to build meshes of, without its image if
+             the planes are shared
+    layout -- layout of the SharedPlanes holding solid's image, or None if
+              solid was sent with its image
+    """
+    
+    global workerSolid, workerBlocks
+    
+    if layout is not None:
+        planes, workerBlocks = attach_planes(layout)
+        solid.img = ImageWrapper.from_planes(planes)
+    elif isinstance(solid.img, TiledImageWrapper):
+        solid.img.reopen()
+    
+    workerSolid = solid
+
+def export_face(task):
+    """
+    Writes the mesh of one face of the worker's Sphere to its own file.
+    
+    Arguments:
+    task -- (faceNum, path, fileFormat, colorMode) tuple (see
+            open_mesh_file)
+    """
+    
+    faceNum, path, fileFormat, colorMode = task
+    print("writing sphere face " + str(faceNum))
+    
+    try:
+        out = open_mesh_file(path, fileFormat, colorMode)
+        write_mesh_file(workerSolid, out, workerSolid.faces[faceNum])
+        out.close()
+    except SystemExit as e:
+        raise WorkerExit(str(e.code))
+
+def band_count(task):
+    """
+    Counts the triangles of one band of the mesh of the worker's solid.
+    
+    Arguments:
+    task -- (faceNum, rows) tuple, where faceNum is the index of the face
+            in the Sphere's faces (None for a Prism) and rows is the range
+            of rows of the band (see mesh_band)
+    
+    Return -- int number of triangles in the band
+    """
+    
+    faceNum, rows = task
+    face = None if faceNum is None else workerSolid.faces[faceNum]
+    
+    try:
+        return band_triangle_count(workerSolid, face, rows)
+    except SystemExit as e:
+        raise WorkerExit(str(e.code))
+
+def band_records(task):
+    """
+    Builds one band of the mesh of the worker's solid.
+    
+    Arguments:
+    task -- (faceNum, rows, colorMode) tuple: the band (as for band_count)
+            and the STL color mode
+    
+    Return -- STL_RECORD array of the triangles in the band
+    """
+    
+    faceNum, rows, colorMode = task
+    face = None if faceNum is None else workerSolid.faces[faceNum]
+    
+    try:
+        return mesh_records(*mesh_band(workerSolid, colorMode, face, rows))
+    except SystemExit as e:
+        raise WorkerExit(str(e.code))
+
+def indexed_band_task(task):
+    """
+    Builds one band of the mesh of the worker's solid for an indexed mesh
+    file.
+    
+    Arguments:
+    task -- (faceNum, rows, colors) tuple: the band (as for band_count) and
+            whether to sample vertex colors
+    
+    Return -- tuple returned by indexed_band
+    """
+    
+    faceNum, rows, colors = task
+    face = None if faceNum is None else workerSolid.faces[faceNum]
+    
+    try:
+        return indexed_band(workerSolid, face, rows, colors)
+    except SystemExit as e:
+        raise WorkerExit(str(e.code))
+
+def write_band(task):
+    """
+    Builds one band of the mesh of the worker's solid and writes it into
+    the part of an STL file allocated for it, through a memory map.
+    
+    Arguments:
+    task -- (faceNum, rows, colorMode, path, offset, count) tuple: the band
+            (as for band_count), the STL color mode, the path of the file,
+            the byte offset of the band's triangles in it and the number
+            of triangles counted for the band
+    """
+    
+    faceNum, rows, colorMode, path, offset, count = task
+    face = None if faceNum is None else workerSolid.faces[faceNum]
+    
+    try:
+        records = mesh_records(*mesh_band(workerSolid, colorMode, face,
+                                          rows))
+    except SystemExit as e:
+        raise WorkerExit(str(e.code))
+    
+    if len(records) != count:
+        raise WorkerExit("Error: band of " + str(len(records))
+                         + " triangles did not match its count of "
+                         + str(count))
+    
+    if count == 0:
+        return
+    
+    # files without a color mode must not have color attributes
+    if colorMode not in STL_COLOR_MODES:
+        records["attr"] = 0
+    
+    out = np.memmap(path, dtype=STL_RECORD, mode='r+', offset=offset,
+                    shape=(count,))
+    out[:] = records
+    out.flush()
+    del out
+
+def share_solid(solid):
+    """
+    Prepares solid to be sent to worker processes.
+    
+    Return -- (solid, shared), where solid is the one to send (a copy
+              without its image if the image planes were put in shared
+              memory) and shared is the SharedPlanes, or None
+    """
+    
+    # tiled heightmaps are never decoded as a whole, so there are no planes
+    # to share; each worker opens the heightmap again instead (see
+    # init_worker)
+    if isinstance(solid.img, TiledImageWrapper):
+        return solid, None
+    
+    shared = SharedPlanes(solid.img.planes())
+    solid = copy.copy(solid)
+    solid.img = None
+    return solid, shared
+
+def write_faces_parallel(solid, paths, fileFormat, colorMode, workers):
+    """
+    Writes the mesh of each face of a Sphere to its own file, with the
+    faces divided between a pool of worker processes.
+    
+    Arguments:
+    solid -- The Sphere to write the faces of
+    paths -- list of the path of the file for each face
+    fileFormat -- format of the files (see open_mesh_file)
+    colorMode -- color mode of the files (see open_mesh_file)
+    workers -- int number of worker processes
+    """
+    
+    sentSolid, shared = share_solid(solid)
+    layout = None if shared is None else shared.layout
+    tasks = [(faceNum, paths[faceNum], fileFormat, colorMode)
+             for faceNum in range(len(solid.faces))]
+    
+    try:
+        with multiprocessing.Pool(workers, init_worker,
+                                  (sentSolid, layout)) as pool:
+            pool.map(export_face, tasks, chunksize=1)
+    except WorkerExit as e:
+        sys.exit(str(e))
+    finally:
+        if shared is not None:
+            shared.close()
+
+class BandPool():
+    """
+    Pool of worker processes that build the bands of rows of the mesh of a
+    solid (see write_mesh_tris) several at a time, so that even a single
+    face or prism is built on every core. Each band only depends on its
+    own rows of points (neighboring bands share a row), so the bands are
+    built independently, each by whichever worker is free. A tiled
+    heightmap is read by each worker through its own handle (see
+    init_worker), never through the one this process opened.
+    """
+    
+    def __init__(self, solid, workers):
+        """
+        Arguments:
+        solid -- The Sphere or Prism to build meshes of
+        workers -- int number of worker processes
+        """
+        
+        self.solid = solid
+        self.workers = workers
+        sentSolid, self.shared = share_solid(solid)
+        layout = None if self.shared is None else self.shared.layout
+        
+        try:
+            self.pool = multiprocessing.Pool(workers, init_worker,
+                                             (sentSolid, layout))
+        except:
+            if self.shared is not None:
+                self.shared.close()
+            raise
+    
+    def bands(self, face=None, bandRows=None):
+        """
+        Returns the list of (faceNum, rows) bands of face (if the solid is
+        a Sphere) or of the solid itself (if Prism), as sent to workers.
+        """
+        
+        faceNum = None
+        
+        if face is not None:
+            faceNum = [i for i in range(len(self.solid.faces))
+                       if self.solid.faces[i] is face][0]
+        
+        return [(faceNum, rows) for rows
+                in band_ranges(self.solid, face, bandRows)]
+    
+    def band_counts(self, face=None, bandRows=None):
+        """
+        Returns the list of the number of triangles in each band (see
+        bands), counted in the worker processes.
+        """
+        
+        try:
+            return self.pool.map(band_count, self.bands(face, bandRows),
+                                 chunksize=1)
+        except WorkerExit as e:
+            sys.exit(str(e))
+    
+    def mesh_bands(self, colorMode, face=None, bandRows=None):
+        """
+        Builds the bands (see bands) in the worker processes, for writing
+        to a file that can only be written in order (as a stream).
+        
+        Arguments:
+        colorMode -- STL color mode ('RGB' or 'BGR') to pack colors for, or
+                     None
+        face -- The TriFace or QuadFace, for a Sphere
+        bandRows -- int number of rows of mesh triangles in each band, or
+                    None for a single band
+        
+        Yield -- STL_RECORD array of the triangles of each band, in order
+        """
+        
+        tasks = [(faceNum, rows, colorMode)
+                 for faceNum, rows in self.bands(face, bandRows)]
+        return self.ordered_results(band_records, tasks)
+    
+    def indexed_bands(self, colors, face=None, bandRows=None):
+        """
+        Builds the bands (see bands) in the worker processes for an indexed
+        mesh file, which are written in order.
+        
+        Arguments:
+        colors -- bool whether to sample vertex colors
+        face -- The TriFace or QuadFace, for a Sphere
+        bandRows -- int number of rows of mesh triangles in each band, or
+                    None for a single band
+        
+        Yield -- tuple returned by indexed_band for each band, in order
+        """
+        
+        tasks = [(faceNum, rows, colors)
+                 for faceNum, rows in self.bands(face, bandRows)]
+        return self.ordered_results(indexed_band_task, tasks)
+    
+    def ordered_results(self, function, tasks):
+        """
+        Runs function on each of tasks in the worker processes, yielding
+        the results in the order of tasks
+        """
+        
+        # only a few tasks are started ahead of the one being used, so that
+        # finished results do not pile up in memory waiting their turn
+        pending = collections.deque()
+        
+        try:
+            for task in tasks:
+                pending.append(self.pool.apply_async(function, (task,)))
+                
+                if len(pending) >= 2 * self.workers:
+                    yield pending.popleft().get()
+            
+            while pending:
+                yield pending.popleft().get()
+        except WorkerExit as e:
+            sys.exit(str(e))
+    
+    def write_bands(self, stl, face=None, bandRows=None):
+        """
+        Writes the mesh of face (if the solid is a Sphere) or of the solid
+        itself (if Prism) to stl in bands, as write_mesh_tris does, but
+        with the bands built in the worker processes. The triangles of each
+        band are counted first, so the file can be extended to its final
+        size at once and each worker can write its band straight to its
+        own place in the file.
+        
+        Arguments:
+        stl -- The STLFileWrapper to write to (not a streamed one)
+        face -- The TriFace or QuadFace, for a Sphere
+        bandRows -- int number of rows of mesh triangles in each band, or
+                    None for a single band
+        """
+        
+        bands = self.bands(face, bandRows)
+        counts = self.band_counts(face, bandRows)
+        offset = stl.allocate(sum(counts))
+        tasks = []
+        
+        for (faceNum, rows), count in zip(bands, counts):
+            tasks.append((faceNum, rows, stl.colormode, stl.path, offset,
+                          count))
+            offset += count * STL_RECORD.itemsize
+        
+        try:
+            self.pool.map(write_band, tasks, chunksize=1)
+        except WorkerExit as e:
+            sys.exit(str(e))
+    
+    def close(self):
+        """Stops the worker processes and frees the shared memory"""
+        
+        self.pool.terminate()
+        self.pool.join()
+        
+        if self.shared is not None:
+            self.shared.close()
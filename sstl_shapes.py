@@ -1,6 +1,10 @@
 from sstl_math import *
 from sstl_image import *
 
+# number of points along each side of the grid Sphere.lod_for_face measures
+# mesh spacing over
+LOD_GRID_SIZE = 9
+
 class TriFace():
     """A triange face for a Sphere, defined by its three points"""
     
@@ -95,13 +99,16 @@ class Sphere():
     """
     
     def __init__(self, img, proj, faces, normalizeFaceVertices, minAltitude,
-                 maxAltitude, lowCutoff, rotation, scale):
+                 maxAltitude, lowCutoff, rotation, scale, mipmaps=False,
+                 collapseBottoms=False, maxError=None, adaptiveError=None):
         """
         img -- an ImageWrapper or interface-equivalent object containing
                depth map data
         proj -- a function mapping a cartesian point (float arraylike,
                 length 3, sphere center at origin)
-                to a point on img (arraylike of 2 nums in range [0, 1])
+                to a point on img (arraylike of 2 nums in range [0, 1]),
+                and likewise an (N, 3) array of points to an (N, 2) array
+                (as with the functions in projections)
         faces -- list of TriFace or QuadFace faces to project depth map onto
         normalizeFaceVertices -- boolean, whether the distance of the corner
                                  points of each face in faces should be
@@ -117,6 +124,23 @@ class Sphere():
         scale -- float arraylike, length 3, scale factors on X, Y, and Z,
                  respectively. Values may be negative but the absolute
                  value is taken. May be None
+        mipmaps -- bool whether each face should sample img at the mip level
+                   matching its mesh spacing (see lod_for_face), rather than
+                   always at full size (default False)
+        collapseBottoms -- bool whether the flat bottom surfaces of faces
+                           with flatBottom set are made of as few triangles
+                           as possible, rather than one under each top
+                           surface triangle (default False)
+        maxError -- float largest height error (after scaling, along the
+                    normal of each face) decimating the top surface of each
+                    face may add (see decimate_mesh), or None to keep every
+                    triangle (default None)
+        adaptiveError -- float largest distance (after scaling) a point of
+                         each face may be left out of the top surface by
+                         subdividing it adaptively (see
+                         adaptive_triangulation), or None for the uniform
+                         grid (default None). The face resolutions must
+                         then be powers of 2.
         """
         
         if lowCutoff >= maxAltitude:
@@ -147,43 +171,164 @@ class Sphere():
         self.minAltitude = minAltitude
         self.maxAltitude = maxAltitude
         self.lowCutoff = lowCutoff
+        self.mipmaps = mipmaps
+        self.collapseBottoms = collapseBottoms
+        self.maxError = maxError
+        self.adaptiveError = adaptiveError
+    
+    def lod_for_face(self, face):
+        """
+        Returns the mip level of img (see ImageWrapper.mip) to sample face
+        at: 0 (full size) unless mipmaps are enabled, otherwise the level
+        matching the spacing of the face's mesh points once projected onto
+        img. The spacing is measured over a coarse grid of points on the
+        face, and the closest spacing found is used so that no detail the
+        mesh could hold is filtered out.
+        """
+        
+        if not self.mipmaps:
+            return 0
+        
+        if self.normalizeFaceVertices:
+            corners = [normalize(pt) for pt in face.pts]
+        else:
+            corners = [np.array(pt, dtype=np.float64) for pt in face.pts]
+        
+        # a single mesh step along each axis of the face
+        if isinstance(face, TriFace):
+            axes = ((corners[1] - corners[0]) / face.resolution,
+                    (corners[2] - corners[1]) / face.resolution)
+            resolutions = (face.resolution, face.resolution)
+        else:
+            axes = ((corners[1] - corners[0]) / face.resolution1,
+                    (corners[2] - corners[0]) / face.resolution2)
+            resolutions = (face.resolution1, face.resolution2)
         
-    def height_at_pt(self, pt):
+        c1, c2 = np.meshgrid(np.linspace(0, 1, LOD_GRID_SIZE),
+                             np.linspace(0, 1, LOD_GRID_SIZE))
+        
+        # TriFace points only cover half of the grid
+        if isinstance(face, TriFace):
+            inFace = c2 <= c1
+            c1 = c1[inFace]
+            c2 = c2[inFace]
+        
+        pts = corners[0] + np.multiply.outer(c1.ravel(),
+                                             axes[0] * resolutions[0]) \
+              + np.multiply.outer(c2.ravel(), axes[1] * resolutions[1])
+        locs = self.proj(pts)
+        spacing = float('inf')
+        
+        for axis in axes:
+            steps = self.proj(pts + axis) - locs
+            steps[:, 0] = (steps[:, 0] + 0.5) % 1 - 0.5 # u wraps around
+            spacing = min(spacing,
+                          np.min(np.hypot(steps[:, 0] * self.img.size[0],
+                                          steps[:, 1] * self.img.size[1])))
+        
+        return self.img.level_for_spacing(spacing)
+    
+    def height_at_pt(self, pt, level=0):
         """
         Arguments:
         pt -- float arraylike, length 3, cartesian point to project into
               spherical and check depth value at
+        level -- int mip level of img to sample (default 0, full size)
         
         Return -- float distance from sphere center (origin) to pt
         """
         
         loc = self.proj(pt)
-        return self.img.height_at_loc(loc) * (self.maxAltitude
+        return self.img.height_at_loc(loc, level) * (self.maxAltitude
                - self.minAltitude) + self.minAltitude
     
-    def hole_at_pt(self, pt):
+    def heights_at_pts(self, pts, level=0):
+        """
+        Arguments:
+        pts -- float arraylike of shape (N, 3), cartesian points to project
+               into spherical and check depth values at
+        level -- int mip level of img to sample (default 0, full size)
+        
+        Return -- float array of N distances from sphere center (origin)
+        """
+        
+        locs = self.proj(np.asarray(pts, dtype=np.float64))
+        heights = self.img.height_at_locs(locs[..., 0], locs[..., 1], level)
+        return heights.astype(np.float64) * (self.maxAltitude
+               - self.minAltitude) + self.minAltitude
+    
+    def holes_at_pts(self, pts, level=0):
+        """
+        Arguments:
+        pts -- float arraylike of shape (N, 3), cartesian points to project
+               into spherical and check hole status at
+        level -- int mip level of img to sample (default 0, full size)
+        
+        Return -- bool array of whether the depth map has a hole at each
+                  point
+        """
+        
+        locs = self.proj(np.asarray(pts, dtype=np.float64))
+        return self.img.holes_at_locs(locs[..., 0], locs[..., 1], level)
+    
+    def hole_at_pt(self, pt, level=0):
         """
         Arguments:
         pt -- float arraylike, length 3, cartesian point to project into
               spherical and check hole status at
+        level -- int mip level of img to sample (default 0, full size)
         
         Return -- Whether the depth map has a hole at pt
         """
         
         loc = self.proj(pt)
-        return self.img.hole_at_loc(loc)
+        return self.img.hole_at_loc(loc, level)
     
-    def color_at_pt(self, pt):
+    def color_at_pt(self, pt, level=0):
         """
         Arguments:
         pt -- float arraylike, length 3, cartesian point to project into
               spherical and check hole status at
+        level -- int mip level of img to sample (default 0, full size)
         
         Return -- Color of the image at pt (if there is a color image)
         """
         
         loc = self.proj(pt)
-        return self.img.color_at_loc(loc)
+        return self.img.color_at_loc(loc, level)
+    
+    def colors_at_pts(self, pts, colorMode, level=0):
+        """
+        Arguments:
+        pts -- float arraylike of shape (N, 3), cartesian points to project
+               into spherical and check color at
+        colorMode -- STL color mode ('RGB' or 'BGR') to pack colors for
+        level -- int mip level of img to sample (default 0, full size)
+        
+        Return -- uint16 array of N STL color attribute words (all 0 if
+                  there is no color image or colorMode is not a color mode)
+        """
+        
+        if len(pts) == 0 or colorMode not in STL_COLOR_MODES:
+            return np.zeros(len(pts), dtype=np.uint16)
+        
+        locs = self.proj(np.asarray(pts, dtype=np.float64))
+        return self.img.colors_at_locs(locs[:, 0], locs[:, 1], colorMode,
+                                       level)
+    
+    def rgbs_at_pts(self, pts, level=0):
+        """
+        Arguments:
+        pts -- float arraylike of shape (N, 3), cartesian points to project
+               into spherical and check color at
+        level -- int mip level of img to sample (default 0, full size)
+        
+        Return -- (N, 3) uint8 array of the colors (r, g, b) of the image at
+                  pts, or None if there is no color image
+        """
+        
+        locs = self.proj(np.asarray(pts, dtype=np.float64).reshape(-1, 3))
+        return self.img.rgbs_at_locs(locs[:, 0], locs[:, 1], level)
             
 # the cutoff is at 0- negative minAltitude will result in holes
 # resolutions are 1 less than the number of points along their given axis,
@@ -192,7 +337,8 @@ class Prism():
     """Rectangular prism to apply depth map to"""
     
     def __init__(self, img, w, h, resolutionX, resolutionY, minAltitude,
-                 maxAltitude):
+                 maxAltitude, mipmaps=False, collapseBottoms=False,
+                 maxError=None, adaptiveError=None):
         """
         img -- an ImageWrapper or interface-equivalent object containing
                depth map data
@@ -206,6 +352,20 @@ class Prism():
                        may be negative.
         maxAltitude -- height corresponding to depth values of 1 from img,
                        must be positive and > minAltitude.
+        mipmaps -- bool whether to sample img at the mip level matching the
+                   mesh spacing (see lod_for_face), rather than always at
+                   full size (default False)
+        collapseBottoms -- bool whether the flat bottom surface is made of
+                           as few triangles as possible, rather than one
+                           under each top surface triangle (default False)
+        maxError -- float largest height error decimating the top surface
+                    may add (see decimate_mesh), or None to keep every
+                    triangle (default None)
+        adaptiveError -- float largest distance a point may be left out of
+                         the top surface by subdividing it adaptively (see
+                         adaptive_triangulation), or None for the uniform
+                         grid (default None). The resolutions must then be
+                         powers of 2.
         """
         
         if minAltitude < 0:
@@ -226,40 +386,121 @@ class Prism():
         self.resolutionY = resolutionY
         self.minAltitude = minAltitude
         self.maxAltitude = maxAltitude
+        self.mipmaps = mipmaps
+        self.collapseBottoms = collapseBottoms
+        self.maxError = maxError
+        self.adaptiveError = adaptiveError
+    
+    def lod_for_face(self, face=None):
+        """
+        Returns the mip level of img (see ImageWrapper.mip) to sample at:
+        0 (full size) unless mipmaps are enabled, otherwise the level
+        matching the spacing of the mesh points over img. face is ignored
+        (it is there to match Sphere.lod_for_face).
+        """
+        
+        if not self.mipmaps:
+            return 0
         
-    def height_at_pt(self, pt):
+        return self.img.level_for_spacing(
+            min(self.img.size[0] / self.resolutionX,
+                self.img.size[1] / self.resolutionY))
+    
+    def height_at_pt(self, pt, level=0):
         """
         Arguments:
         pt -- float arraylike, length 2, positions on prism along w and h,
               respectively (in range 0 to 1)
+        level -- int mip level of img to sample (default 0, full size)
         
         Return -- float distance from sphere center (origin) to pt
         """
         
-        return self.img.height_at_loc(pt) * (self.maxAltitude \
+        return self.img.height_at_loc(pt, level) * (self.maxAltitude \
                - self.minAltitude) + self.minAltitude
+    
+    def heights_at_pts(self, pts, level=0):
+        """
+        Arguments:
+        pts -- float arraylike of shape (N, 2), positions on prism along w
+               and h, respectively (in range 0 to 1)
+        level -- int mip level of img to sample (default 0, full size)
         
-    def hole_at_pt(self, pt):
+        Return -- float array of N heights
+        """
+        
+        pts = np.asarray(pts, dtype=np.float64)
+        heights = self.img.height_at_locs(pts[..., 0], pts[..., 1], level)
+        return heights.astype(np.float64) * (self.maxAltitude
+               - self.minAltitude) + self.minAltitude
+    
+    def holes_at_pts(self, pts, level=0):
+        """
+        Arguments:
+        pts -- float arraylike of shape (N, 2), positions on prism along w
+               and h, respectively (in range 0 to 1)
+        level -- int mip level of img to sample (default 0, full size)
+        
+        Return -- bool array of whether the depth map has a hole at each
+                  position
+        """
+        
+        pts = np.asarray(pts, dtype=np.float64)
+        return self.img.holes_at_locs(pts[..., 0], pts[..., 1], level)
+        
+    def hole_at_pt(self, pt, level=0):
         """
         Arguments:
         pt -- float arraylike, length 2, positions on prism along w and h,
               respectively (in range 0 to 1)
+        level -- int mip level of img to sample (default 0, full size)
         
         Return -- Whether the depth map has a hole at pt
         """
         
-        return self.img.hole_at_loc(pt)
+        return self.img.hole_at_loc(pt, level)
     
-    def color_at_pt(self, pt):
+    def color_at_pt(self, pt, level=0):
         """
         Arguments:
         pt -- float arraylike, length 2, positions on prism along w and h,
               respectively (in range 0 to 1)
+        level -- int mip level of img to sample (default 0, full size)
         
         Return -- RGB color at pt, or None if there is no color image
         """
         
-        return self.img.color_at_loc(loc)
+        return self.img.color_at_loc(pt, level)
+    
+    def colors_at_pts(self, pts, colorMode, level=0):
+        """
+        Arguments:
+        pts -- float arraylike of shape (N, 2), positions on prism along w
+               and h, respectively (in range 0 to 1)
+        colorMode -- STL color mode ('RGB' or 'BGR') to pack colors for
+        level -- int mip level of img to sample (default 0, full size)
+        
+        Return -- uint16 array of N STL color attribute words (all 0 if
+                  there is no color image or colorMode is not a color mode)
+        """
+        
+        pts = np.asarray(pts, dtype=np.float64).reshape(-1, 2)
+        return self.img.colors_at_locs(pts[:, 0], pts[:, 1], colorMode,
+                                       level)
+    
+    def rgbs_at_pts(self, pts, level=0):
+        """
+        Arguments:
+        pts -- float arraylike of shape (N, 2), positions on prism along w
+               and h, respectively (in range 0 to 1)
+        level -- int mip level of img to sample (default 0, full size)
+        
+        Return -- (N, 3) uint8 array of the colors (r, g, b) of the image at
+                  pts, or None if there is no color image
+        """
+        
+        pts = np.asarray(pts, dtype=np.float64).reshape(-1, 2)
+        return self.img.rgbs_at_locs(pts[:, 0], pts[:, 1], level)
 
 # unrotatedIcosaPts = [(0, -1, -phi), (0, -1, phi), (0, 1, -phi), (0, 1, phi),
 #                      (-1, -phi, 0), (-1, phi, 0), (1, -phi, 0), (1, phi, 0),
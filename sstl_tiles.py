@@ -0,0 +1,265 @@
+import os
+import sys
+from collections import OrderedDict
+import numpy as np
+from PIL import Image
+from sstl_image import *
+
+try:
+    import tifffile
+except ImportError:
+    tifffile = None
+
+TILED_IMAGE_EXTENSIONS = ('.npy', '.raw', '.tif', '.tiff')
+
+class ArrayTileSource():
+    """
+    Serves square tiles out of an array-like heightmap (typically a
+    numpy.memmap, so only the parts of the file that are read get paged in).
+    """
+    
+    def __init__(self, data, tileSize):
+        """
+        Arguments:
+        data -- array-like heightmap indexed [y, x] (optionally with a
+                trailing channel axis)
+        tileSize -- int width and height of each tile in pixels
+        """
+        
+        self.data = data
+        self.size = (data.shape[1], data.shape[0])
+        self.tileSize = (tileSize, tileSize)
+    
+    def read_tile(self, tx, ty):
+        """Returns the float32 heights of the tile at tile column tx, row ty"""
+        
+        x = tx * self.tileSize[0]
+        y = ty * self.tileSize[1]
+        return array_to_depth(self.data[y:y + self.tileSize[1],
+                                        x:x + self.tileSize[0]])
+
+class TiffTileSource():
+    """
+    Serves the tiles of a tiled TIFF heightmap, decoding each one from the
+    file only when it is read.
+    """
+    
+    def __init__(self, tif):
+        """
+        Arguments:
+        tif -- open tifffile.TiffFile whose first page is tiled
+        """
+        
+        self.tif = tif
+        self.page = tif.pages[0]
+        self.size = (self.page.imagewidth, self.page.imagelength)
+        self.tileSize = (self.page.tilewidth, self.page.tilelength)
+        self.tilesAcross = -(-self.size[0] // self.tileSize[0])
+    
+    def read_tile(self, tx, ty):
+        """Returns the float32 heights of the tile at tile column tx, row ty"""
+        
+        index = ty * self.tilesAcross + tx
+        fh = self.tif.filehandle
+        fh.seek(self.page.dataoffsets[index])
+        data = fh.read(self.page.databytecounts[index])
+        tile = self.page.decode(data, index,
+                                jpegtables=self.page.jpegtables)[0]
+        
+        # edge tiles are stored padded to the full tile size
+        width = min(self.tileSize[0], self.size[0] - tx * self.tileSize[0])
+        height = min(self.tileSize[1], self.size[1] - ty * self.tileSize[1])
+        tile = tile[0, :height, :width]
+        return array_to_depth(tile[..., 0] if tile.shape[2] == 1 else tile)
+
+def open_tile_source(imgPath, tileSize, rawWidth=None, rawHeight=None,
+                     rawDtype=None):
+    """
+    Opens a heightmap too large to decode into memory as a tile source.
+    
+    Arguments:
+    imgPath -- Path to a .npy file, a headerless .raw file, or a TIFF file.
+               TIFFs are read tile by tile if they are tiled, or memory
+               mapped if they are uncompressed (requires the tifffile
+               package either way).
+    tileSize -- int size of the tiles to page .npy, .raw and uncompressed
+                TIFF files in by
+    rawWidth, rawHeight -- int dimensions of a .raw file in pixels
+    rawDtype -- numpy dtype string of the samples in a .raw file
+    """
+    
+    ext = os.path.splitext(imgPath)[1].lower()
+    
+    try:
+        if ext == '.npy':
+            return ArrayTileSource(np.load(imgPath, mmap_mode='r'), tileSize)
+        elif ext == '.raw':
+            if rawWidth is None or rawHeight is None or rawDtype is None:
+                sys.exit("Error: rawWidth, rawHeight and rawDtype must be"
+                         + " given to read " + imgPath)
+            
+            return ArrayTileSource(np.memmap(imgPath, dtype=rawDtype, mode='r',
+                shape=(rawHeight, rawWidth)), tileSize)
+        elif ext == '.tif' or ext == '.tiff':
+            if tifffile is None:
+                sys.exit("Error: the tifffile package is required to read"
+                         + " TIFF heightmaps tile by tile")
+            
+            tif = tifffile.TiffFile(imgPath)
+            
+            if tif.pages[0].is_tiled:
+                return TiffTileSource(tif)
+            
+            tif.close()
+            return ArrayTileSource(tifffile.memmap(imgPath, mode='r'),
+                                   tileSize)
+    except (OSError, ValueError) as e:
+        sys.exit("Error: failed to open heightmap at " + imgPath + " ("
+                 + str(e) + ")")
+    
+    sys.exit("Error: heightmap at " + imgPath + " is not one of the types"
+             + " that can be read in tiles ("
+             + ", ".join(TILED_IMAGE_EXTENSIONS) + ")")
+
+class TiledImageWrapper(ImageWrapper):
+    """
+    Works the same as ImageWrapper, but for heightmaps too large to hold in
+    memory: the heightmap is never decoded as a whole. Tiles are decoded as
+    lookups need them and kept in a least recently used cache of bounded
+    size, so memory use depends on the tile cache size and not on the size
+    of the image. Holes come from the "alpha" image only, and there are
+    no mip levels (every lookup is into the full size images).
+    """
+    
+    def __init__(self, imgPath, alphaPath=None, colorPath=None,
+                 tileSize=1024, tileCacheSize=64, rawWidth=None,
+                 rawHeight=None, rawDtype=None):
+        """
+        Opens and prepares images to be used for height map
+        
+        Arguments:
+        imgPath -- Path to the base heightmap (see open_tile_source for the
+                   supported types)
+        alphaPath -- Path to image determining hole locations, as for
+                     ImageWrapper
+        colorPath -- Path to color image, as for ImageWrapper
+        tileSize -- int size in pixels of the tiles .npy, .raw and
+                    uncompressed TIFF heightmaps are paged in by (tiled
+                    TIFFs use their own tiles)
+        tileCacheSize -- int maximum number of decoded tiles kept in memory
+        rawWidth, rawHeight, rawDtype -- layout of a .raw heightmap (see
+                                         open_tile_source)
+        """
+        
+        self.sourceArgs = (imgPath, tileSize, rawWidth, rawHeight, rawDtype)
+        self.source = open_tile_source(*self.sourceArgs)
+        self.size = self.source.size
+        self.tileCacheSize = max(1, tileCacheSize)
+        self.tiles = OrderedDict()
+        
+        alpha = None
+        
+        if alphaPath is not None:
+            try:
+                alpha = Image.open(alphaPath)
+            except:
+                print("Error: failed to open image at " + alphaPath)
+            
+            alpha = alpha.convert('L')
+        
+        self.build_hole_mask(None, alpha)
+        self.load_color(colorPath)
+    
+    def __getstate__(self):
+        """
+        Pickles the wrapper without its tile source or cached tiles (a copy
+        sent to another process reopens the heightmap itself, rather than
+        copying the memory mapped or open file across).
+        """
+        
+        state = self.__dict__.copy()
+        del state["source"]
+        state["tiles"] = OrderedDict()
+        return state
+    
+    def __setstate__(self, state):
+        """Unpickles the wrapper, reopening its tile source"""
+        
+        self.__dict__.update(state)
+        self.reopen()
+    
+    def reopen(self):
+        """
+        Opens the heightmap again and empties the tile cache. A worker
+        process started by forking shares the open file (and its position)
+        with every other one, so each reopens it before reading any tiles.
+        """
+        
+        self.source = open_tile_source(*self.sourceArgs)
+        self.tiles = OrderedDict()
+    
+    def tile(self, tx, ty):
+        """
+        Returns the decoded tile at tile column tx, row ty, reading it in
+        (and evicting the least recently used tile if the cache is full)
+        if it is not cached.
+        """
+        
+        key = (tx, ty)
+        
+        if key in self.tiles:
+            self.tiles.move_to_end(key)
+        else:
+            if len(self.tiles) >= self.tileCacheSize:
+                self.tiles.popitem(last=False)
+            
+            self.tiles[key] = self.source.read_tile(tx, ty)
+        
+        return self.tiles[key]
+    
+    def mip(self, level):
+        """Returns this wrapper for every level, as there are no mip levels"""
+        
+        return self
+    
+    def level_for_spacing(self, spacing):
+        """Returns level 0, as there are no mip levels"""
+        
+        return 0
+    
+    def depth_luma_at_pixel(self, loc):
+        """Returns the luma value at the pixel coordinates in loc."""
+        
+        x = int(loc[0])
+        y = int(loc[1])
+        tileSize = self.source.tileSize
+        tile = self.tile(x // tileSize[0], y // tileSize[1])
+        return float(tile[y % tileSize[1], x % tileSize[0]])
+    
+    def height_at_locs(self, u, v, level=0):
+        """
+        Returns an array of heights (luma values, range [0, 1]) at the
+        coordinates given by the arrays u and v (range [0, 1]), reading in
+        only the tiles those coordinates fall in. level is ignored.
+        """
+        
+        x, y = locs_to_pixels(u, v, self.size)
+        x = x.ravel()
+        y = y.ravel()
+        tileSize = self.source.tileSize
+        tilesAcross = -(-self.size[0] // tileSize[0])
+        tileIds = (y // tileSize[1]) * tilesAcross + x // tileSize[0]
+        
+        # visit each tile once, gathering all of the samples that fall in it
+        order = np.argsort(tileIds, kind='stable')
+        starts = np.flatnonzero(np.diff(tileIds[order], prepend=-1))
+        ends = np.append(starts[1:], len(order))
+        heights = np.empty(len(order), dtype=np.float32)
+        
+        for start, end in zip(starts, ends):
+            idx = order[start:end]
+            tileId = tileIds[idx[0]]
+            tile = self.tile(tileId % tilesAcross, tileId // tilesAcross)
+            heights[idx] = tile[y[idx] % tileSize[1], x[idx] % tileSize[0]]
+        
+        return heights.reshape(np.shape(u))